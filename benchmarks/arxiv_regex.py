@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Benchmark of the arXiv identifiers extraction, comparing the trie-based
+regex of ``libbmc.repositories.arxiv`` with the former plain alternation of
+the old-style categories.
+
+Usage: python benchmarks/arxiv_regex.py [TEXT_FILE ...]
+
+Without arguments, a synthetic corpus of about 10 MB is used.
+"""
+import os
+import random
+import re
+import sys
+import timeit
+
+# Run from a source checkout, without installing libbmc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from libbmc import tools
+from libbmc.repositories import arxiv
+
+
+# Former regex, with a plain alternation of the old-style categories
+OLD_REGEX = re.compile(
+    "((arxiv:)?((" + arxiv.ARXIV_IDENTIFIER_FROM_2007 + ")|(" +
+    r"(" + "|".join(arxiv.ARXIV_CATEGORIES_BEFORE_2007) + r")/\d+" + ")))",
+    re.IGNORECASE)
+
+
+def old_extract_from_text(text):
+    """
+    Former implementation of ``arxiv.extract_from_text``.
+    """
+    return tools.remove_duplicates([re.sub("arxiv:", "", i[0],
+                                           flags=re.IGNORECASE)
+                                    for i in OLD_REGEX.findall(text)
+                                    if i[0] != ''])
+
+
+def synthetic_corpus(size=10 * 1024 * 1024):
+    """
+    Build a text looking like extracted papers, with a few arXiv IDs.
+    """
+    random.seed(0)
+    words = ["the", "of", "quantum", "gas", "physics", "astro", "math",
+             "theorem", "2015", "et", "al.", "Phys.", "Rev.", "cond-mat",
+             "arXiv", "1506.06690v2", "arXiv:1401.2910", "math.GT/0309136",
+             "hep-th/9901001", "doi:10.1209/0295-5075/111/40005"]
+    weights = [100] * 15 + [1] * 5
+    chunks = []
+    length = 0
+    while length < size:
+        chunk = " ".join(random.choices(words, weights, k=1000))
+        chunks.append(chunk)
+        length += len(chunk)
+    return "\n".join(chunks)
+
+
+def main(paths):
+    if paths:
+        corpus = []
+        for path in paths:
+            with open(path, 'r', errors="replace") as fh:
+                corpus.append(fh.read())
+        corpus = "\n".join(corpus)
+    else:
+        corpus = synthetic_corpus()
+    print("Corpus size: %.1f MB" % (len(corpus) / 1024 / 1024,))
+
+    assert (sorted(old_extract_from_text(corpus)) ==
+            sorted(arxiv.extract_from_text(corpus)))
+    for name, function in [("plain alternation", old_extract_from_text),
+                           ("trie", arxiv.extract_from_text)]:
+        timing = min(timeit.repeat(lambda: function(corpus),
+                                   number=1, repeat=3))
+        print("%-20s %.3f s" % (name, timing))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Benchmark of the import time of ``libbmc`` modules, each one being imported
+in a fresh interpreter.
+
+Usage: python benchmarks/import_time.py [MODULE ...]
+
+Without arguments, the identifier-related modules are benchmarked.
+"""
+import statistics
+import subprocess
+import sys
+
+
+# Modules benchmarked by default
+MODULES = ["libbmc", "libbmc.doi", "libbmc.isbn", "libbmc.repositories.arxiv",
+           "libbmc.papers.identifiers"]
+# Third-party modules which should not be loaded by a bare import
+HEAVY_MODULES = ["requests", "isbnlib", "arxiv2bib", "PyPDF2", "bs4"]
+# Number of fresh interpreters per module
+RUNS = 10
+
+# Code run in the fresh interpreters
+SNIPPET = """
+import sys
+import time
+start = time.perf_counter()
+import %s
+print(time.perf_counter() - start)
+print(",".join(name for name in %r if name in sys.modules))
+"""
+
+
+def import_time(module):
+    """
+    Import a module in a fresh interpreter.
+
+    :returns: A tuple of the import time in seconds and the list of heavy \
+            modules loaded.
+    """
+    output = subprocess.check_output(
+        [sys.executable, "-c", SNIPPET % (module, HEAVY_MODULES)])
+    duration, loaded = output.decode("utf-8").splitlines()
+    return float(duration), [i for i in loaded.split(",") if i]
+
+
+def main(modules):
+    for module in modules:
+        results = [import_time(module) for _ in range(RUNS)]
+        print("%-28s %7.1f ms   loaded: %s" % (
+            module,
+            1000 * statistics.median(duration for duration, _ in results),
+            ", ".join(results[0][1]) or "-"))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or MODULES)
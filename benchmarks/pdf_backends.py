@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Benchmark of the PDF to text backends of ``libbmc.papers.identifiers``,
+comparing the per-file latency of ``find_identifiers`` with ``pdftotext``
+(one process spawned per file) and with the in-process PyPDF2 backend.
+
+Usage: python benchmarks/pdf_backends.py [PDF_FILE ...]
+
+Without arguments, a synthetic corpus of small PDF files is used. The
+``pdftotext`` backend is skipped if it is not installed.
+"""
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+# Run from a source checkout, without installing libbmc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from libbmc.papers import identifiers
+from libbmc.tests.helpers import make_pdf
+
+
+# Number of files and pages per file of the synthetic corpus
+FILES = 50
+PAGES = 10
+
+
+def synthetic_corpus(directory):
+    """
+    Write small PDF files looking like papers, with a DOI on the first page.
+    """
+    random.seed(0)
+    words = ["the", "of", "quantum", "gas", "physics", "theorem", "et", "al."]
+    paths = []
+    for i in range(FILES):
+        pages = ["doi:10.1209/0295-5075/111/%05d" % (i,)]
+        pages += [" ".join(random.choices(words, k=12))
+                  for _ in range(PAGES - 1)]
+        path = os.path.join(directory, "paper%d.pdf" % (i,))
+        with open(path, "wb") as fh:
+            fh.write(make_pdf(pages))
+        paths.append(path)
+    return paths
+
+
+def latencies(paths, backend, pages):
+    """
+    Time ``find_identifiers`` on each file with a given backend.
+
+    :returns: A tuple of the list of per-file latencies in seconds and the \
+            number of identifiers found.
+    """
+    identifiers.PDF_BACKEND = backend
+    timings = []
+    found = 0
+    for path in paths:
+        start = time.perf_counter()
+        if identifiers.find_identifiers(path, pages=pages)[0] is not None:
+            found += 1
+        timings.append(time.perf_counter() - start)
+    return timings, found
+
+
+def main(paths):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if not paths:
+            paths = synthetic_corpus(tmpdir)
+        backends = ["pypdf2"]
+        if shutil.which("pdftotext") is not None:
+            backends.insert(0, "pdftotext")
+        print("Corpus: %d files" % (len(paths),))
+        for backend in backends:
+            for pages in [None, 2]:
+                timings, found = latencies(paths, backend, pages)
+                print("%-10s pages=%-5s median %6.2f ms   max %6.2f ms   "
+                      "found %d" % (backend, pages,
+                                    1000 * statistics.median(timings),
+                                    1000 * max(timings), found))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
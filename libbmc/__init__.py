@@ -5,7 +5,8 @@ The :mod:`libbmc` is a generic Python library to manage bibliography and play
 with scientific papers.
 """
 
-# Global list of valid paper identifier types. See README.md.
-__valid_identifiers__ = []
+# Global list of valid paper identifier types, by order of relevance. See
+# README.md. Associated modules are only imported on first use.
+__valid_identifiers__ = ["doi", "isbn", "repositories.arxiv"]
 
 __version__ = "0.2.1"
@@ -0,0 +1,509 @@
+"""
+This file contains classes to cache locally some data fetched from the
+network, to avoid fetching it again.
+"""
+import collections
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from libbmc import tools
+
+# Size of the chunks used to hash cached files (1 MiB)
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    """
+    Compute the SHA256 hash of a file.
+
+    :param path: The path to the file to hash.
+    :returns: The hexadecimal digest of the file content.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for buf in iter(lambda: fh.read(CHUNK_SIZE), b""):
+            sha256.update(buf)
+    return sha256.hexdigest()
+
+
+class MemoryCache(object):
+    """
+    A thread-safe in-memory cache, with expiration of the entries and \
+    eviction of the least recently used ones.
+
+    :param max_size: Maximum number of entries in the cache.
+    :param ttl: Time to live of the entries, in seconds. ``None`` for no \
+            expiration.
+
+    >>> memory_cache = MemoryCache(max_size=2)
+    >>> memory_cache.set("a", 1); memory_cache.set("b", 2)
+    >>> memory_cache.get("a")
+    1
+    >>> memory_cache.set("c", 3)
+    >>> memory_cache.get("b") is None
+    True
+    """
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Get an entry from the cache.
+
+        :param key: The key of the entry.
+        :param default: Value to return if the entry is not in the cache or \
+                expired.
+        :returns: The cached value, or ``default``.
+        """
+        with self._lock:
+            try:
+                expires, value = self._entries[key]
+            except KeyError:
+                return default
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Add an entry to the cache.
+
+        :param key: The key of the entry.
+        :param value: The value to store.
+        :param ttl: Time to live of this entry, in seconds. Defaults to the \
+                ``ttl`` of the cache.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove all the entries from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteStore(object):
+    """
+    Base class of the data stores backed by an SQLite database.
+
+    .. note::
+
+        A new connection is opened for each operation, so that stores can \
+                be shared by several threads and processes.
+
+    :param path: Path to the SQLite database. Created if needed.
+    """
+    # Maximum number of keys per query, below the maximum number of SQLite
+    # parameters
+    MAX_KEYS_PER_QUERY = 500
+
+    def __init__(self, path):
+        self.path = path
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        Open a connection to the database, committing on success.
+        """
+        db = sqlite3.connect(self.path, timeout=60)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _select_in(self, db, query, keys, params=()):
+        """
+        Run a query matching a column against many keys, in batches.
+
+        :param db: An open connection, see :meth:`_connect`.
+        :param query: The query, with a ``%s`` placeholder for the list of \
+                keys (e.g. ``"SELECT a, b FROM t WHERE a IN (%s)"``), \
+                followed by the placeholders of ``params``.
+        :param keys: An iterable of keys.
+        :param params: Extra parameters of the query.
+        :returns: An iterator of the rows returned by the query.
+        """
+        for keys_batch in tools.batch(keys, self.MAX_KEYS_PER_QUERY):
+            keys_batch = list(keys_batch)
+            yield from db.execute(
+                query % (", ".join("?" * len(keys_batch)),),
+                keys_batch + list(params))
+
+
+class PersistentCache(SQLiteStore):
+    """
+    A persistent key-value cache, stored in an SQLite database, with \
+    expiration of the entries.
+
+    .. note::
+
+        Values should be JSON-serializable. ``None`` is a valid value, to \
+                cache negative results.
+
+    .. note::
+
+        The cache can be shared by several threads and processes.
+
+    :param path: Path to the SQLite database. Created if needed.
+    :param ttl: Default time to live of the entries, in seconds. ``None`` \
+            for no expiration.
+    """
+    def __init__(self, path, ttl=None):
+        super().__init__(path)
+        self.ttl = ttl
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                       "key TEXT PRIMARY KEY, "
+                       "value TEXT, "
+                       "expires REAL)")
+
+    def get(self, key, default=None):
+        """
+        Get an entry from the cache.
+
+        :param key: The key (a string) of the entry.
+        :param default: Value to return if the entry is not in the cache or \
+                expired.
+        :returns: The cached value, or ``default``.
+        """
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        """
+        Get many entries from the cache at once.
+
+        :param keys: An iterable of keys (strings).
+        :returns: A dict of the keys found in the cache (and not expired) \
+                and their values.
+        """
+        with self._connect() as db:
+            return {key: json.loads(value)
+                    for key, value in self._select_in(
+                        db,
+                        "SELECT key, value FROM entries WHERE key IN (%s) "
+                        "AND (expires IS NULL OR expires >= ?)",
+                        keys, [time.time()])}
+
+    def set(self, key, value, ttl=None):
+        """
+        Add an entry to the cache.
+
+        :param key: The key (a string) of the entry.
+        :param value: The (JSON-serializable) value to store.
+        :param ttl: Time to live of this entry, in seconds. Defaults to the \
+                ``ttl`` of the cache.
+        """
+        self.set_many([(key, value, ttl)])
+
+    def set_many(self, entries):
+        """
+        Add many entries to the cache at once, in a single transaction.
+
+        :param entries: An iterable of ``(key, value, ttl)`` tuples, see \
+                :meth:`set`.
+        """
+        now = time.time()
+        rows = []
+        for key, value, ttl in entries:
+            if ttl is None:
+                ttl = self.ttl
+            rows.append((key, json.dumps(value),
+                         now + ttl if ttl is not None else None))
+        with self._connect() as db:
+            db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                           rows)
+
+    def purge(self):
+        """
+        Remove the expired entries from the cache.
+        """
+        with self._connect() as db:
+            db.execute("DELETE FROM entries WHERE expires < ?",
+                       (time.time(),))
+
+
+class DownloadCache(SQLiteStore):
+    """
+    A content-addressed on-disk cache of downloaded documents.
+
+    Documents are stored in the ``objects`` folder of the cache directory, \
+    named after the SHA256 hash of their content, so that a document served \
+    at several URLs is stored only once. An SQLite index maps URLs to \
+    documents, along with the ``ETag`` and ``Last-Modified`` validators \
+    used to revalidate them.
+
+    .. note::
+
+        The cache can be shared by several threads and processes.
+
+    :param directory: Path to the cache directory. Created if needed.
+    :param max_size: Maximum total size of the cached documents, in bytes. \
+            Least recently used documents are evicted first. Defaults to \
+            ``None``, that is no limit.
+    """
+    def __init__(self, directory, max_size=None):
+        super().__init__(os.path.join(directory, "index.sqlite"))
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS urls ("
+                       "url TEXT PRIMARY KEY, "
+                       "digest TEXT NOT NULL, "
+                       "contenttype TEXT, "
+                       "etag TEXT, "
+                       "last_modified TEXT, "
+                       "size INTEGER NOT NULL, "
+                       "last_access REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS urls_digest "
+                       "ON urls (digest)")
+
+    def _object_path(self, digest):
+        """
+        Get the path of the document with the given digest.
+
+        :param digest: The SHA256 hexadecimal digest of the document.
+        :returns: The path to the cached document.
+        """
+        return os.path.join(self.directory, "objects", digest[:2], digest)
+
+    def lookup(self, url):
+        """
+        Look up an URL in the cache.
+
+        :param url: The URL of the document.
+        :returns: A dict with ``path``, ``contenttype``, ``size``, ``etag`` \
+                and ``last_modified`` keys, or ``None`` if the URL is not \
+                cached.
+        """
+        with self._connect() as db:
+            row = db.execute("SELECT digest, contenttype, etag, "
+                             "last_modified, size FROM urls WHERE url = ?",
+                             (url,)).fetchone()
+            if row is None:
+                return None
+            digest, contenttype, etag, last_modified, size = row
+            path = self._object_path(digest)
+            if not os.path.isfile(path):
+                # Document was removed behind our back
+                db.execute("DELETE FROM urls WHERE url = ?", (url,))
+                return None
+            db.execute("UPDATE urls SET last_access = ? WHERE url = ?",
+                       (time.time(), url))
+        return {
+            "path": path,
+            "contenttype": contenttype,
+            "size": size,
+            "etag": etag,
+            "last_modified": last_modified
+        }
+
+    def store(self, url, path, contenttype, etag=None, last_modified=None):
+        """
+        Store a downloaded document in the cache.
+
+        .. note::
+
+            The file at ``path`` is moved to the cache, so it should be on \
+                    the same filesystem as the cache directory.
+
+        :param url: The URL of the document.
+        :param path: The path to the downloaded document.
+        :param contenttype: The type of the document.
+        :param etag: The ``ETag`` header of the response, if any.
+        :param last_modified: The ``Last-Modified`` header of the response, \
+                if any.
+        :returns: The path to the cached document.
+        """
+        digest = hash_file(path)
+        size = os.path.getsize(path)
+        object_path = self._object_path(digest)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        # Replacing an existing document is harmless, as it has the same
+        # content.
+        os.replace(path, object_path)
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO urls VALUES "
+                       "(?, ?, ?, ?, ?, ?, ?)",
+                       (url, digest, contenttype, etag, last_modified, size,
+                        time.time()))
+        self.evict(keep=digest)
+        return object_path
+
+    def evict(self, keep=None):
+        """
+        Evict the least recently used documents, until the total size of \
+                the cache is below ``max_size``.
+
+        :param keep: An optional digest of a document to keep in any case.
+        """
+        if self.max_size is None:
+            return
+        with self._connect() as db:
+            total = db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM "
+                "(SELECT DISTINCT digest, size FROM urls)").fetchone()[0]
+            while total > self.max_size:
+                row = db.execute(
+                    "SELECT url, digest, size FROM urls WHERE digest IS NOT ? "
+                    "ORDER BY last_access LIMIT 1", (keep,)).fetchone()
+                if row is None:
+                    break
+                url, digest, size = row
+                db.execute("DELETE FROM urls WHERE url = ?", (url,))
+                still_used = db.execute(
+                    "SELECT 1 FROM urls WHERE digest = ? LIMIT 1",
+                    (digest,)).fetchone()
+                if still_used is None:
+                    try:
+                        os.remove(self._object_path(digest))
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+
+
+class TextCache(SQLiteStore):
+    """
+    A persistent cache of the text extracted from files (e.g. by \
+    ``pdftotext``), stored in an SQLite database.
+
+    Texts are keyed by the SHA256 hash of the file content and a variant \
+    string, identifying the extraction tool and its options (e.g. a range \
+    of pages). Hashes are kept along with the size and modification time \
+    of the files, so that unchanged files are not hashed again.
+
+    .. note::
+
+        The cache can be shared by several threads and processes.
+
+    :param path: Path to the SQLite database. Created if needed.
+    :param max_size: Maximum total size of the cached texts, in characters \
+            (or bytes for binary outputs). Least recently used texts are \
+            evicted first. Defaults to ``None``, that is no limit.
+    """
+    def __init__(self, path, max_size=None):
+        super().__init__(path)
+        self.max_size = max_size
+        with self._connect() as db:
+            # Let readers and writers work concurrently
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS files ("
+                       "path TEXT PRIMARY KEY, "
+                       "size INTEGER NOT NULL, "
+                       "mtime REAL NOT NULL, "
+                       "digest TEXT NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS texts ("
+                       "digest TEXT NOT NULL, "
+                       "variant TEXT NOT NULL, "
+                       "content BLOB NOT NULL, "
+                       "size INTEGER NOT NULL, "
+                       "last_access REAL NOT NULL, "
+                       "PRIMARY KEY (digest, variant))")
+            db.execute("CREATE INDEX IF NOT EXISTS texts_last_access "
+                       "ON texts (last_access)")
+
+    def file_digest(self, src):
+        """
+        Get the SHA256 hash of a file, hashing it only if it changed since \
+                last call.
+
+        :param src: The path to the file.
+        :returns: The hexadecimal digest of the file content.
+        """
+        src = os.path.realpath(src)
+        stat = os.stat(src)
+        with self._connect() as db:
+            row = db.execute("SELECT digest FROM files WHERE path = ? "
+                             "AND size = ? AND mtime = ?",
+                             (src, stat.st_size, stat.st_mtime)).fetchone()
+        if row is not None:
+            return row[0]
+        digest = hash_file(src)
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                       (src, stat.st_size, stat.st_mtime, digest))
+        return digest
+
+    def get(self, src, variant):
+        """
+        Get the text extracted from a file from the cache.
+
+        :param src: The path to the file.
+        :param variant: The variant of the text, e.g. ``"pdftotext"``.
+        :returns: The cached text, or ``None``.
+        """
+        try:
+            digest = self.file_digest(src)
+        except OSError:
+            return None
+        with self._connect() as db:
+            row = db.execute("SELECT content FROM texts WHERE digest = ? "
+                             "AND variant = ?", (digest, variant)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE texts SET last_access = ? WHERE digest = ? "
+                       "AND variant = ?", (time.time(), digest, variant))
+        return row[0]
+
+    def set(self, src, variant, content):
+        """
+        Store the text extracted from a file in the cache.
+
+        :param src: The path to the file.
+        :param variant: The variant of the text, e.g. ``"pdftotext"``.
+        :param content: The extracted text (or bytes).
+        """
+        try:
+            digest = self.file_digest(src)
+        except OSError:
+            return
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO texts VALUES (?, ?, ?, ?, ?)",
+                       (digest, variant, content, len(content), time.time()))
+        self.evict()
+
+    def evict(self):
+        """
+        Evict the least recently used texts, until the total size of the \
+                cache is below ``max_size``.
+        """
+        if self.max_size is None:
+            return
+        with self._connect() as db:
+            total = db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM texts").fetchone()[0]
+            if total <= self.max_size:
+                return
+            # Only read the least recently used texts which must go
+            evicted = []
+            for digest, variant, size in db.execute(
+                    "SELECT digest, variant, size FROM texts "
+                    "ORDER BY last_access"):
+                if total <= self.max_size:
+                    break
+                evicted.append((digest, variant))
+                total -= size
+            db.executemany("DELETE FROM texts WHERE digest = ? "
+                           "AND variant = ?", evicted)
+            # Forget the files without any cached text
+            db.execute("DELETE FROM files WHERE digest NOT IN "
+                       "(SELECT digest FROM texts)")
@@ -18,7 +18,7 @@ CERMINE_BASE_URL = "http://cermine.ceon.pl/"
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 
 
-def cermine(pdf_file, force_api=False, override_local=None):
+def cermine(pdf_file, force_api=False, override_local=None, text_cache=None):
     """
     Run `CERMINE <https://github.com/CeON/CERMINE>`_ to extract metadata from \
             the given PDF file, to retrieve citations (and more) from the \
@@ -49,9 +49,18 @@ def cermine(pdf_file, force_api=False, override_local=None):
             (and do not try to use a local JAR file). Defaults to ``False``.
     :param override_local: Use this specific JAR file, instead of the one at \
             the default location (``libbmc/external/cermine.jar``).
+    :param text_cache: An optional :class:`libbmc.cache.TextCache`, to \
+            avoid running CERMINE again on the same file.
     :returns: Raw output from CERMINE API or ``None`` if an error occurred. \
             No post-processing is done.
     """
+    if text_cache is not None:
+        output = text_cache.get(pdf_file, "cermine")
+        if output is None:
+            output = cermine(pdf_file, force_api, override_local)
+            if output is not None:
+                text_cache.set(pdf_file, "cermine", output)
+        return output
     try:
         # Check if we want to load the local JAR from a specific path
         local = override_local
@@ -87,7 +96,8 @@ def cermine(pdf_file, force_api=False, override_local=None):
         return None
 
 
-def cermine_dois(pdf_file, force_api=False, override_local=None):
+def cermine_dois(pdf_file, force_api=False, override_local=None,
+                 text_cache=None):
     """
     Run `CERMINE <https://github.com/CeON/CERMINE>`_ to extract DOIs of cited \
             papers from a PDF file.
@@ -121,13 +131,15 @@ def cermine_dois(pdf_file, force_api=False, override_local=None):
             (and do not try to use a local JAR file). Defaults to ``False``.
     :param override_local: Use this specific JAR file, instead of the one at \
             the default location (``libbmc/external/cermine.jar``).
+    :param text_cache: An optional :class:`libbmc.cache.TextCache`, see \
+            :func:`cermine`.
     :returns: A dict of cleaned plaintext citations and their associated DOI.
     """
     # TODO:
     #    * Do not convert to plain text, but use the extra metadata from
     #      CERMINE
     # Call CERMINE on the PDF file
-    cermine_output = cermine(pdf_file, force_api, override_local)
+    cermine_output = cermine(pdf_file, force_api, override_local, text_cache)
     # Parse the resulting XML
     root = ET.fromstring(cermine_output)
     plaintext_references = [
@@ -178,7 +190,7 @@ def grobid(pdf_folder, grobid_home=None, grobid_jar=None):
         return False
 
 
-def pdfextract(pdf_file):
+def pdfextract(pdf_file, text_cache=None):
     """
     Run `pdfextract <https://github.com/CrossRef/pdfextract>`_ on a given PDF \
             file to extract references.
@@ -201,11 +213,20 @@ def pdfextract(pdf_file):
                 `this Github issue <https://github.com/CrossRef/pdfextract/issues/23>`_.
 
     :param pdf_file: Path to the PDF file to handle.
+    :param text_cache: An optional :class:`libbmc.cache.TextCache`, to \
+            avoid running ``pdfextract`` again on the same file.
     :returns: Raw output from ``pdfextract`` or ``None`` if an error \
             occurred. No post-processing is done. See \
             ``libbmc.citations.pdf.pdfextract_dois`` for a similar function \
             with post-processing to return DOIs.
     """
+    if text_cache is not None:
+        references = text_cache.get(pdf_file, "pdfextract")
+        if references is None:
+            references = pdfextract(pdf_file)
+            if references is not None:
+                text_cache.set(pdf_file, "pdfextract", references)
+        return references
     try:
         # Run pdf-extract
         references = subprocess.check_output(["pdf-extract",
@@ -216,7 +237,7 @@ def pdfextract(pdf_file):
         return None
 
 
-def pdfextract_dois(pdf_file):
+def pdfextract_dois(pdf_file, text_cache=None):
     """
     Extract DOIs of references using \
             `pdfextract <https://github.com/CrossRef/pdfextract>`_.
@@ -229,10 +250,12 @@ def pdfextract_dois(pdf_file):
                 returned value, as it is ultimately called by this function.
 
     :param pdf_file: Path to the PDF file to handle.
+    :param text_cache: An optional :class:`libbmc.cache.TextCache`, see \
+            :func:`pdfextract`.
     :returns: A dict of cleaned plaintext citations and their associated DOI.
     """
     # Call pdf-extract on the PDF file
-    references = pdfextract(pdf_file)
+    references = pdfextract(pdf_file, text_cache)
     # Parse the resulting XML
     root = ET.fromstring(references)
     plaintext_references = [e.text for e in root.iter("reference")]
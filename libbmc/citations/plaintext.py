@@ -3,11 +3,11 @@ This file contains all the functions to extract DOIs of citations from
 plaintext files.
 """
 import os
-import requests
 
 from requests.exceptions import RequestException
 
 from libbmc import doi
+from libbmc import network
 from libbmc import tools
 from libbmc.repositories import arxiv
 
@@ -61,6 +61,7 @@ def get_cited_dois(file):
         # Else, we passed a list of plaintext citations.
         plaintext_citations = file
     dois = {}
+    arxiv_queue = {}
     crossref_queue = []
 
     # Try to get the DOI directly from the citation
@@ -74,20 +75,25 @@ def get_cited_dois(file):
         # Same thing for arXiv id
         matched_arxiv = arxiv.extract_from_text(citation)
         if len(matched_arxiv) > 0:
-            # Add the associated DOI and go on
-            dois[citation] = arxiv.to_doi(next(iter(matched_arxiv)))
+            # Stack it to fetch the associated DOIs at once and go on
+            arxiv_queue[citation] = next(iter(matched_arxiv))
             continue
         # If no match found, stack it for next step
         # Note to remove URLs in the citation as the plaintext citations can
         # contain URLs and they are bad for the CrossRef API.
         crossref_queue.append(tools.remove_urls(citation))
 
+    # Get the DOIs associated to the arXiv ids in batch
+    arxiv_dois = arxiv.to_dois(arxiv_queue.values())
+    for citation, arxiv_id in arxiv_queue.items():
+        dois[citation] = arxiv_dois[arxiv_id]
+
     # Do batch with remaining papers, to prevent from the timeout of CrossRef
     for batch in tools.batch(crossref_queue, CROSSREF_MAX_BATCH_SIZE):
         batch = [i for i in batch]
         try:
             # Fetch results from CrossRef
-            request = requests.post(CROSSREF_LINKS_API_URL, json=batch)
+            request = network.post(CROSSREF_LINKS_API_URL, json=batch)
             for result in request.json()["results"]:
                 # Try to get a DOI
                 try:
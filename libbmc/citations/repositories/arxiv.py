@@ -2,6 +2,11 @@
 This file contains all the functions to extract DOIs of citations from arXiv
 papers.
 """
+import concurrent.futures
+import os
+import subprocess
+
+from libbmc import tools
 from libbmc.citations import bbl
 from libbmc.repositories import arxiv
 
@@ -20,9 +25,8 @@ def get_plaintext_citations(arxiv_id):
     :returns:  A list of cleaned plaintext citations.
     """
     plaintext_citations = []
-    # Get the list of bbl files for this preprint
-    bbl_files = arxiv.get_bbl(arxiv_id)
-    for bbl_file in bbl_files:
+    # Stream the bbl files of this preprint
+    for bbl_file in arxiv.iter_bbl(arxiv_id):
         # Fetch the cited DOIs for each of the bbl files
         plaintext_citations.extend(bbl.get_plaintext_citations(bbl_file))
     return plaintext_citations
@@ -42,9 +46,71 @@ def get_cited_dois(arxiv_id):
     :returns: A dict of cleaned plaintext citations and their associated DOI.
     """
     dois = {}
-    # Get the list of bbl files for this preprint
-    bbl_files = arxiv.get_bbl(arxiv_id)
-    for bbl_file in bbl_files:
+    # Stream the bbl files of this preprint
+    for bbl_file in arxiv.iter_bbl(arxiv_id):
         # Fetch the cited DOIs for each of the bbl files
         dois.update(bbl.get_cited_dois(bbl_file))
     return dois
+
+
+def _parse_bbl_files(paper):
+    """
+    Get the plaintext citations from the .bbl files of a preprint.
+
+    :param paper: A ``(arxiv_id, bbl_files)`` tuple, ``bbl_files`` being a \
+            list of the full text of the ``.bbl`` files of the preprint.
+    :returns: A list of cleaned plaintext citations, or ``None`` if an \
+            error occurred.
+    """
+    _, bbl_files = paper
+    plaintext_citations = []
+    try:
+        for bbl_file in bbl_files:
+            plaintext_citations.extend(bbl.get_plaintext_citations(bbl_file))
+    except subprocess.CalledProcessError:
+        return None
+    return plaintext_citations
+
+
+def process_dump(dump, index_path, max_workers=None):
+    """
+    Get the plaintext citations of all the preprints of an arXiv bulk \
+            source dump on disk, and store them in an index.
+
+    .. note::
+
+        This works offline, see \
+                :func:`libbmc.repositories.arxiv.iter_bbl_from_dump`. The \
+                ``.bbl`` files are parsed in a pool of processes.
+
+    .. note::
+
+        The index is a JSON lines file, with one \
+                ``{"arxiv_id": ..., "citations": [...]}`` object per \
+                preprint. It is written incrementally, and preprints already \
+                in the index are skipped, so that an interrupted run can be \
+                resumed by calling this function again. Preprints whose \
+                ``.bbl`` files could not be parsed are not written, to be \
+                retried on next run.
+
+    :param dump: Either the path to a dump tarball or the path to a \
+            directory of dump tarballs.
+    :param index_path: The path to the index.
+    :param max_workers: Maximum number of processes. Defaults to the number \
+            of CPUs.
+    :returns: The number of preprints added to the index.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    added = 0
+    with tools.Checkpoint(index_path, "arxiv_id") as index:
+        papers = arxiv.iter_bbl_from_dump(dump, skip=index.processed)
+        for (arxiv_id, _), plaintext_citations in tools.concurrent_map(
+                _parse_bbl_files, papers, max_workers=max_workers,
+                executor_class=concurrent.futures.ProcessPoolExecutor):
+            if plaintext_citations is None:
+                continue
+            index.append({"arxiv_id": arxiv_id,
+                          "citations": plaintext_citations})
+            added += 1
+    return added
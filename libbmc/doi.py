@@ -2,15 +2,14 @@
 This file contains all the DOI-related functions.
 """
 import re
-import requests
+import urllib.parse
 
-from requests.exceptions import RequestException
-
-from libbmc import __valid_identifiers__
+from libbmc import cache
 from libbmc import tools
 
-# Append DOI to the valid identifiers list
-__valid_identifiers__ += ["doi"]
+# Network dependencies are loaded on first use
+network = tools.lazy_import("libbmc.network")
+requests = tools.lazy_import("requests")
 
 # Taken from
 # https://stackoverflow.com/questions/27910/finding-a-doi-in-a-document-or-page/10324802#10324802
@@ -19,8 +18,18 @@ REGEX = re.compile(r"\b(10[.][0-9]{4,}(?:[.][0-9]+)*/(?:(?![\"&\'])\S)+)\b",
 # Base dx.doi.org URL for redirections
 DX_URL = "http://dx.doi.org/{doi}"
 
+# Number of DOIs looked up at once in the persistent caches
+CACHE_BATCH_SIZE = 500
+
 # Base DISSEMIN API
 DISSEMIN_API = "http://beta.dissem.in/api/"
+# Cache of the paper records fetched from Dissemin, keyed by DOI
+DISSEMIN_CACHE = cache.MemoryCache(max_size=4096, ttl=3600)
+
+# Time to live of the results stored in persistent caches (30 days), and of
+# the negative results (1 day)
+CACHE_TTL = 30 * 24 * 3600
+NEGATIVE_CACHE_TTL = 24 * 3600
 
 
 def is_valid(doi):
@@ -113,13 +122,61 @@ def to_canonical(urls):
     return tools.map_or_apply(extract_from_text, urls)
 
 
+def get_dissemin_record(doi):
+    """
+    Get the paper record from Dissemin for a given DOI.
+
+    .. note::
+
+        Uses beta.dissem.in API. Records are kept in ``DISSEMIN_CACHE``, so \
+                that subsequent calls for the same DOI do not hit the API.
+
+    :param doi: A canonical DOI.
+    :returns: The paper record from Dissemin, as a dict, or ``None``.
+
+    >>> get_dissemin_record('10.1209/0295-5075/111/40005')["pdf_url"]
+    'http://arxiv.org/abs/1506.06690'
+    """
+    record = DISSEMIN_CACHE.get(doi)
+    if record is not None:
+        return record
+    try:
+        request = network.get("%s%s" % (DISSEMIN_API, doi))
+        request.raise_for_status()
+        result = request.json()
+        assert result["status"] == "ok"
+        record = result["paper"]
+    except (AssertionError, ValueError, KeyError,
+            requests.exceptions.RequestException):
+        return None
+    DISSEMIN_CACHE.set(doi, record)
+    return record
+
+
+def get_dissemin_records(dois, max_workers=8):
+    """
+    Get the paper records from Dissemin for many DOIs, concurrently.
+
+    .. note::
+
+        Uses beta.dissem.in API. See :func:`get_dissemin_record`.
+
+    :param dois: An iterable of canonical DOIs.
+    :param max_workers: Maximum number of concurrent requests.
+    :returns: A dict mapping each DOI to its paper record from Dissemin, \
+            or ``None``.
+    """
+    return dict(tools.concurrent_map(get_dissemin_record, dois,
+                                     max_workers=max_workers))
+
+
 def get_oa_version(doi):
     """
     Get an OA version for a given DOI.
 
     .. note::
 
-        Uses beta.dissem.in API.
+        Uses beta.dissem.in API. See :func:`get_dissemin_record`.
 
     :param doi: A canonical DOI.
     :returns: The URL of the OA version of the given DOI, or ``None``.
@@ -128,12 +185,8 @@ def get_oa_version(doi):
     'http://arxiv.org/abs/1506.06690'
     """
     try:
-        request = requests.get("%s%s" % (DISSEMIN_API, doi))
-        request.raise_for_status()
-        result = request.json()
-        assert result["status"] == "ok"
-        return result["paper"]["pdf_url"]
-    except (AssertionError, ValueError, KeyError, RequestException):
+        return get_dissemin_record(doi)["pdf_url"]
+    except (KeyError, TypeError):
         return None
 
 
@@ -143,7 +196,7 @@ def get_oa_policy(doi):
 
     .. note::
 
-        Uses beta.dissem.in API.
+        Uses beta.dissem.in API. See :func:`get_dissemin_record`.
 
     :param doi: A canonical DOI.
     :returns: The OpenAccess policy for the associated publications, or \
@@ -156,35 +209,170 @@ def get_oa_policy(doi):
     True
     """
     try:
-        request = requests.get("%s%s" % (DISSEMIN_API, doi))
-        request.raise_for_status()
-        result = request.json()
-        assert result["status"] == "ok"
         return ([i
-                 for i in result["paper"]["publications"]
+                 for i in get_dissemin_record(doi)["publications"]
                  if i["doi"] == doi][0])["policy"]
-    except (AssertionError, ValueError,
-            KeyError, RequestException, IndexError):
+    except (KeyError, TypeError, IndexError):
         return None
 
 
-def get_linked_version(doi):
+def _get_linked_version_helper(doi, max_redirects):
+    """
+    Follow the redirections behind a DOI.
+
+    :param doi: A canonical DOI.
+    :param max_redirects: Maximum number of redirections to follow.
+    :returns: The URL reached after following at most ``max_redirects`` \
+            redirections, or ``None`` if the DOI does not redirect.
+    :raises requests.exceptions.RequestException: If the request to \
+            dx.doi.org failed. Failures of the next hops only stop the \
+            redirections.
+    """
+    url = None
+    next_url = to_url(doi)
+    if max_redirects < 1:
+        return url
+    # Only dx.doi.org says whether the DOI redirects
+    response = network.head(next_url)
+    _raise_for_transient_status(response)
+    for hop in range(max_redirects):
+        if hop > 0:
+            # Publishers often reject HEAD requests, or fail, keep the URL
+            # reached so far then
+            try:
+                response = network.head(next_url)
+            except requests.exceptions.RequestException:
+                break
+            if not response.is_redirect:
+                break
+        location = response.headers.get("location")
+        if location is None:
+            break
+        url = next_url = urllib.parse.urljoin(next_url, location)
+    return url
+
+
+def get_linked_version(doi, max_redirects=1):
     """
     Get the original link behind the DOI.
 
     :param doi: A canonical DOI.
+    :param max_redirects: Maximum number of redirections to follow. \
+            Defaults to ``1``, that is only dx.doi.org redirection.
     :returns: The canonical URL behind the DOI, or ``None``.
 
     >>> get_linked_version('10.1209/0295-5075/111/40005')
     'http://stacks.iop.org/0295-5075/111/i=4/a=40005?key=crossref.9ad851948a976ecdf216d4929b0b6f01'
     """
     try:
-        request = requests.head(to_url(doi))
-        return request.headers.get("location")
-    except RequestException:
+        return _get_linked_version_helper(doi, max_redirects)
+    except requests.exceptions.RequestException:
         return None
 
 
+def iter_linked_versions(dois, max_redirects=1, max_workers=8,
+                         linked_cache=None):
+    """
+    Get the original links behind many DOIs, concurrently.
+
+    .. note::
+
+        DOIs are consumed lazily and results are yielded as soon as they \
+                are available, so that arbitrarily large iterables of DOIs \
+                can be processed. When a persistent cache is given, results \
+                are looked up and stored in it, ``CACHE_BATCH_SIZE`` DOIs at \
+                a time, negative results being kept for \
+                ``NEGATIVE_CACHE_TTL`` seconds only. Failed requests are \
+                not cached.
+
+    :param dois: An iterable of canonical DOIs.
+    :param max_redirects: Maximum number of redirections to follow, see \
+            :func:`get_linked_version`.
+    :param max_workers: Maximum number of concurrent requests.
+    :param linked_cache: An optional :class:`libbmc.cache.PersistentCache`.
+    :returns: An iterator of ``(doi, url)`` tuples, in completion order, \
+            ``url`` being ``None`` if not found.
+    """
+    def fetch(doi):
+        """
+        Get a linked version, along with whether it should be cached.
+        """
+        try:
+            return _get_linked_version_helper(doi, max_redirects), True
+        except requests.exceptions.RequestException:
+            return None, False
+
+    if linked_cache is None:
+        for doi, (url, _) in tools.concurrent_map(fetch, dois,
+                                                  max_workers=max_workers):
+            yield doi, url
+        return
+
+    for dois_batch in tools.batch(dois, CACHE_BATCH_SIZE):
+        keys = {doi: "doi.linked_version:%d:%s" % (max_redirects, doi)
+                for doi in dois_batch}
+        cached = linked_cache.get_many(keys.values())
+        missing = []
+        for doi, key in keys.items():
+            if key in cached:
+                yield doi, cached[key]
+            else:
+                missing.append(doi)
+        entries = []
+        try:
+            for doi, (url, cacheable) in tools.concurrent_map(
+                    fetch, missing, max_workers=max_workers):
+                if cacheable:
+                    entries.append((keys[doi], url,
+                                    CACHE_TTL if url is not None
+                                    else NEGATIVE_CACHE_TTL))
+                yield doi, url
+        finally:
+            # Store the whole batch in a single transaction, even if the
+            # iteration is stopped early
+            linked_cache.set_many(entries)
+
+
+def _raise_for_transient_status(response):
+    """
+    Raise an exception for a response which says nothing definitive about \
+            a DOI, so that it is not cached.
+
+    .. note::
+
+        Only redirections, ``200`` and ``404`` responses are definitive. \
+                Others (e.g. ``429`` after the retries ran out, ``403`` or \
+                server-side errors) may well change on next try.
+
+    :param response: A ``requests.Response`` object.
+    :raises requests.exceptions.HTTPError: If the response is not \
+            definitive.
+    """
+    if response.status_code not in (200, 404) and not response.is_redirect:
+        raise requests.exceptions.HTTPError(
+            "%d response for %s" % (response.status_code, response.url),
+            response=response)
+
+
+def _get_bibtex_helper(doi):
+    """
+    Fetch the BibTeX entry for a given DOI from dx.doi.org.
+
+    :param doi: The canonical DOI to get BibTeX from.
+    :returns: A BibTeX string or ``None`` if there is no BibTeX entry for \
+            this DOI.
+    :raises requests.exceptions.RequestException: If the request failed, \
+            and should be retried later.
+    """
+    request = network.get(to_url(doi),
+                          headers={"accept": "application/x-bibtex"})
+    _raise_for_transient_status(request)
+    if (request.status_code != 200 or
+            request.headers.get("content-type") != "application/x-bibtex"):
+        return None
+    return request.text
+
+
 def get_bibtex(doi):
     """
     Get a BibTeX entry for a given DOI.
@@ -200,10 +388,64 @@ def get_bibtex(doi):
     '@article{Verney_2015,\\n\\tdoi = {10.1209/0295-5075/111/40005},\\n\\turl = {http://dx.doi.org/10.1209/0295-5075/111/40005},\\n\\tyear = 2015,\\n\\tmonth = {aug},\\n\\tpublisher = {{IOP} Publishing},\\n\\tvolume = {111},\\n\\tnumber = {4},\\n\\tpages = {40005},\\n\\tauthor = {Lucas Verney and Lev Pitaevskii and Sandro Stringari},\\n\\ttitle = {Hybridization of first and second sound in a weakly interacting Bose gas},\\n\\tjournal = {{EPL}}\\n}'
     """
     try:
-        request = requests.get(to_url(doi),
-                               headers={"accept": "application/x-bibtex"})
-        request.raise_for_status()
-        assert request.headers.get("content-type") == "application/x-bibtex"
-        return request.text
-    except (RequestException, AssertionError):
+        return _get_bibtex_helper(doi)
+    except requests.exceptions.RequestException:
         return None
+
+
+def get_bibtex_many(dois, max_workers=8, max_rate=10, bibtex_cache=None):
+    """
+    Get BibTeX entries for many DOIs, concurrently.
+
+    .. note::
+
+        Requests to dx.doi.org are rate limited. When a persistent cache is \
+                given, results are stored in it, including DOIs without \
+                BibTeX entry (for ``NEGATIVE_CACHE_TTL`` seconds \
+                only), so that only the missing DOIs are fetched on \
+                subsequent calls. Failed requests are not cached.
+
+    :param dois: An iterable of canonical DOIs.
+    :param max_workers: Maximum number of concurrent requests.
+    :param max_rate: Maximum number of requests per second.
+    :param bibtex_cache: An optional :class:`libbmc.cache.PersistentCache`.
+    :returns: A dict mapping each DOI to its BibTeX string, or ``None``.
+    """
+    dois = tools.remove_duplicates(list(dois))
+    results = {}
+    if bibtex_cache is not None:
+        cached = bibtex_cache.get_many("doi.bibtex:%s" % (doi,)
+                                       for doi in dois)
+        for doi in dois:
+            key = "doi.bibtex:%s" % (doi,)
+            if key in cached:
+                results[doi] = cached[key]
+    rate_limiter = tools.RateLimiter(max_rate)
+
+    def fetch(doi):
+        """
+        Fetch a BibTeX entry, returning it along with whether it should be \
+                cached.
+        """
+        rate_limiter.wait()
+        try:
+            return _get_bibtex_helper(doi), True
+        except requests.exceptions.RequestException:
+            return None, False
+
+    missing = [doi for doi in dois if doi not in results]
+    entries = []
+    try:
+        for doi, (bibtex, cacheable) in tools.concurrent_map(
+                fetch, missing, max_workers=max_workers):
+            results[doi] = bibtex
+            if cacheable:
+                entries.append(("doi.bibtex:%s" % (doi,), bibtex,
+                                CACHE_TTL if bibtex is not None
+                                else NEGATIVE_CACHE_TTL))
+    finally:
+        # Store the fetched entries in a single transaction, even if
+        # interrupted
+        if bibtex_cache is not None:
+            bibtex_cache.set_many(entries)
+    return results
@@ -2,131 +2,922 @@
 This file contains functions to download locally some papers, eventually using
 a proxy.
 """
-import socket
+import concurrent.futures
+import io
+import itertools
+import os
+import shutil
 import sys
-import urllib
+import tempfile
+import threading
+import time
+import urllib.parse
 
-import socks
+import urllib3
 
+from requests.exceptions import RequestException
 
-# Default socket to use, if no proxy is used
-DEFAULT_SOCKET = socket.socket
+from libbmc import network
+from libbmc import tools
 
 
-def _download_helper(url):
+# Size of the chunks used to stream downloaded documents (1 MiB)
+CHUNK_SIZE = 1024 * 1024
+# Size of the chunks used for resumable downloads (64 KiB). An incomplete
+# chunk is lost on network errors, so keep it smaller.
+RESUME_CHUNK_SIZE = 64 * 1024
+
+# Magic bytes at the beginning of the supported documents
+MAGIC_BYTES = {
+    "pdf": b"%PDF-",
+    "djvu": b"AT&TFORM"
+}
+# Content types which do not tell anything about the document. The type of
+# the document is then guessed from its first bytes.
+GENERIC_CONTENT_TYPES = [
+    "",
+    "application/octet-stream",
+    "application/download",
+    "application/force-download",
+    "application/x-download",
+    "application/unknown",
+    "binary/octet-stream"
+]
+
+# Number of consecutive connection failures after which a proxy is skipped,
+# as long as healthier proxies are available
+MAX_PROXY_FAILURES = 3
+
+# Number of consecutive connection failures of each proxy, keyed by proxy
+# string
+_PROXY_FAILURES = {}
+_PROXY_FAILURES_LOCK = threading.Lock()
+
+
+class _ProgressReporter(object):
+    """
+    Report the progress of a single download to a progress hook.
+
+    :param hook: The progress hook, as described in :func:`download`, or \
+            ``None``.
+    :param url: The downloaded URL.
+    :param proxy: The proxy used for this download.
+    :param byte_range: The downloaded byte range, if any.
+    """
+    def __init__(self, hook, url, proxy, byte_range=None):
+        self.hook = hook
+        self.event = {
+            "url": url,
+            "proxy": proxy,
+            "byte_range": byte_range
+        }
+        self.start = time.monotonic()
+        self.ttfb = None
+        # Bytes already downloaded before this request, when resuming
+        self.offset = None
+
+    def __call__(self, status, downloaded, size=None):
+        """
+        Report an event to the progress hook.
+
+        :param status: ``started`` when the response headers are received, \
+                ``progress`` after each chunk and ``finished`` when the \
+                download is complete.
+        :param downloaded: Number of bytes downloaded so far, including \
+                those of a resumed partial download.
+        :param size: Expected number of bytes, if known.
+        """
+        if self.hook is None:
+            return
+        elapsed = time.monotonic() - self.start
+        if self.ttfb is None:
+            self.ttfb = elapsed
+            self.offset = downloaded
+        transfer_time = elapsed - self.ttfb
+        received = downloaded - self.offset
+        event = dict(self.event)
+        event.update({
+            "status": status,
+            "downloaded": downloaded,
+            "size": size,
+            "elapsed": elapsed,
+            "ttfb": self.ttfb,
+            "received": received,
+            "speed": received / transfer_time if transfer_time > 0 else 0.0
+        })
+        self.hook(event)
+
+
+def stdout_progress(event):
+    """
+    A progress hook writing a progress bar on stdout.
+
+    :param event: A progress event, as described in :func:`download`.
+    """
+    if not event["size"]:
+        return
+    done = int(50 * event["downloaded"] / event["size"])
+    sys.stdout.write("\r[%s%s]" % ('='*done, ' '*(50-done)))
+    sys.stdout.write(" "+str(int(float(done)/52*100))+"%")
+    sys.stdout.flush()
+
+
+def _download_helper(url, file_object, proxy, cancelled=None,
+                     progress=None, cached=None):
     """
-    Handle the download of an URL, using the proxy currently set in \
-            :mod:`socks`.
+    Handle the download of an URL, using the given proxy, and stream it \
+            to a file object.
+
+    .. note::
+
+        Updates the health score of the proxy, see :func:`sort_proxies`.
 
     :param url: The URL to download.
-    :returns: A tuple of the raw content of the downloaded data and its \
-            associated content-type. Returns None if it was \
-            unable to download the document.
+    :param file_object: A writable binary file object to stream the \
+            downloaded data to.
+    :param proxy: A proxy string, as described in :func:`download`.
+    :param cancelled: An optional ``threading.Event`` to abort the download.
+    :param progress: An optional progress hook, see :func:`download`.
+    :param cached: An optional dict of a cached version of the document, \
+            as returned by :meth:`libbmc.cache.DownloadCache.lookup`, to \
+            revalidate. It is updated with the validators of the response \
+            and a ``not_modified`` key is set if the cached version is \
+            still valid. In this case, nothing is written to \
+            ``file_object``.
+    :returns: A tuple of the size of the downloaded data and its associated \
+            content-type. Returns None if it was unable to download the \
+            document.
     """
-    # Try to fetch the URL using the current proxy
+    headers = {}
+    if cached is not None:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+    report = _ProgressReporter(progress, url, proxy)
+    # Try to fetch the URL using the given proxy
     try:
-        request = urllib.request.urlopen(url)
-        try:
-            size = int(dict(request.info())['content-length'].strip())
-        except KeyError:
+        with network.get_session(proxy).get(url, stream=True,
+                                     headers=headers) as request:
+            # The proxy did its job, whatever the response is
+            _record_proxy_health(proxy, True)
+            if request.status_code == 304 and headers:
+                # Cached version is still valid
+                cached["not_modified"] = True
+                return (cached["size"], cached["contenttype"])
+            # Check status code and content type before reading the body
+            if request.status_code != 200:
+                # Else, try with the next available proxy
+                return None
+            contenttype = _get_contenttype(request.headers)
+            if (contenttype is None and
+                    not _is_generic_contenttype(request.headers)):
+                return None
             try:
-                size = int(dict(request.info())['Content-Length'].strip())
-            except KeyError:
+                size = int(request.headers.get('content-length', 0))
+            except ValueError:
                 size = 0
-        # Download the document
-        doc = b""
-        doc_size = 0
-        while True:
-            buf = request.read(1024)
-            if buf:
-                doc += buf
+            report("started", 0, size or None)
+            chunks = request.iter_content(CHUNK_SIZE)
+            first_chunk = next(chunks, b"")
+            if contenttype is None:
+                # Guess the type of the document from its first bytes
+                contenttype = _get_contenttype(request.headers, first_chunk)
+                if contenttype is None:
+                    return None
+            # Download the document
+            doc_size = 0
+            for buf in itertools.chain([first_chunk], chunks):
+                if cancelled is not None and cancelled.is_set():
+                    return None
+                file_object.write(buf)
                 doc_size += len(buf)
-                if size != 0:
-                    # Write progress bar on stdout
-                    done = int(50 * doc_size / size)
-                    sys.stdout.write("\r[%s%s]" %
-                                     ('='*done, ' '*(50-done)))
-                    sys.stdout.write(" "+str(int(float(done)/52*100))+"%")
-                    sys.stdout.flush()
-            else:
-                break
-        # Fetch content type
-        contenttype = None
-        contenttype_req = None
-        try:
-            contenttype_req = dict(request.info())['content-type']
-        except KeyError:
-            try:
-                contenttype_req = dict(request.info())['Content-Type']
-            except KeyError:
-                return None
-        if 'pdf' in contenttype_req:
-            contenttype = 'pdf'
-        elif 'djvu' in contenttype_req:
-            contenttype = 'djvu'
-
-        # Check content type and status code are ok
-        if request.getcode() != 200 or contenttype is None:
-            # Else, try with the next available proxy
-            return None
+                report("progress", doc_size, size or None)
+            report("finished", doc_size, size or None)
+            if cached is not None:
+                cached["etag"] = request.headers.get("etag")
+                cached["last_modified"] = request.headers.get("last-modified")
 
-        # Return a tuple of the downloaded content and the content-type
-        return (doc, contenttype)
+            # Return a tuple of the downloaded size and the content-type
+            return (doc_size, contenttype)
     # If an exception occurred, continue with next available proxy
-    except (urllib.error.URLError, socket.error, ValueError):
+    except ValueError:
+        # Invalid URL, do not blame the proxy
+        return None
+    except (RequestException, urllib3.exceptions.HTTPError):
+        _record_proxy_health(proxy, False)
         return None
 
 
-def download(url, proxies=None):
+def _is_generic_contenttype(headers):
     """
-    Download a PDF or DJVU document from a url, eventually using proxies.
+    Check whether the content type from the HTTP headers is a generic one, \
+            which does not tell anything about the document.
+
+    :param headers: The HTTP headers of the response.
+    :returns: A boolean.
+
+    >>> _is_generic_contenttype({"content-type": "application/octet-stream"})
+    True
+
+    >>> _is_generic_contenttype({"content-type": "text/html; charset=utf-8"})
+    False
+    """
+    contenttype_req = headers.get('content-type', '')
+    return (contenttype_req.split(';')[0].strip().lower() in
+            GENERIC_CONTENT_TYPES)
+
+
+def _get_contenttype(headers, first_bytes=None):
+    """
+    Get the type of a downloaded document from the HTTP headers, and \
+            eventually from its first bytes.
+
+    :param headers: The HTTP headers of the response.
+    :param first_bytes: The first bytes of the document, to guess its type \
+            if the content type from the headers is a generic one.
+    :returns: ``pdf``, ``djvu`` or ``None`` if the document is neither a PDF \
+            nor a DJVU file.
+
+    >>> _get_contenttype({"content-type": "application/pdf"})
+    'pdf'
+
+    >>> _get_contenttype({"content-type": "application/octet-stream"}, \
+                         b"AT&TFORM")
+    'djvu'
+
+    >>> _get_contenttype({"content-type": "text/html"}, b"%PDF-") is None
+    True
+    """
+    contenttype_req = headers.get('content-type', '')
+    if 'pdf' in contenttype_req:
+        return 'pdf'
+    elif 'djvu' in contenttype_req:
+        return 'djvu'
+    if first_bytes is not None and _is_generic_contenttype(headers):
+        for contenttype, magic in MAGIC_BYTES.items():
+            if first_bytes.startswith(magic):
+                return contenttype
+    return None
+
+
+def _record_proxy_health(proxy, success):
+    """
+    Update the health score of a proxy.
+
+    :param proxy: A proxy string, as described in :func:`download`.
+    :param success: Whether the last connection through this proxy was \
+            successful or not.
+    """
+    with _PROXY_FAILURES_LOCK:
+        if success:
+            _PROXY_FAILURES.pop(proxy, None)
+        else:
+            _PROXY_FAILURES[proxy] = _PROXY_FAILURES.get(proxy, 0) + 1
+
+
+def reset_proxies_health():
+    """
+    Forget about the previous failures of all the proxies.
+    """
+    with _PROXY_FAILURES_LOCK:
+        _PROXY_FAILURES.clear()
+
+
+def sort_proxies(proxies):
+    """
+    Sort a list of proxies according to their health.
+
+    .. note::
+
+        The health of a proxy is the number of consecutive connection \
+                failures through this proxy, in previous downloads. \
+                Proxies which failed at least ``MAX_PROXY_FAILURES`` times \
+                in a row are skipped, unless all the proxies did.
+
+    :param proxies: A list of proxy strings, as described in \
+            :func:`download`.
+    :returns: The list of proxies to try, healthiest first. Proxies with \
+            the same health are kept in the original order.
+
+    >>> sort_proxies(["", "localhost:3128"])
+    ['', 'localhost:3128']
+    """
+    with _PROXY_FAILURES_LOCK:
+        failures = {proxy: _PROXY_FAILURES.get(proxy, 0)
+                    for proxy in proxies}
+    proxies = sorted(proxies, key=lambda proxy: failures[proxy])
+    healthy = [proxy for proxy in proxies
+               if failures[proxy] < MAX_PROXY_FAILURES]
+    if healthy:
+        return healthy
+    return proxies
+
+
+def _hedged_download_helper(url, file_object, proxies, hedge_delay,
+                            progress=None, cached=None):
+    """
+    Handle the download of an URL, racing the available proxies.
+
+    The download is started with the first proxy. If it is not over after \
+    ``hedge_delay`` seconds (or as soon as it fails), it is started in \
+    parallel with the next proxy, and so on. The first valid document wins \
+    and the other downloads are aborted.
+
+    :param url: The URL to download.
+    :param file_object: A writable binary file object to write the \
+            downloaded data to.
+    :param proxies: A list of proxy strings, as described in \
+            :func:`download`.
+    :param hedge_delay: Delay (in seconds) before starting the download \
+            with the next proxy.
+    :param progress: An optional progress hook, see :func:`download`.
+    :param cached: An optional dict of a cached version of the document, to \
+            revalidate. See :func:`_download_helper`.
+    :returns: A tuple of the size of the downloaded data and its associated \
+            content-type. Returns None if it was unable to download the \
+            document.
+    """
+    if not proxies:
+        return None
+    cancelled = threading.Event()
+
+    def attempt(proxy):
+        """
+        Download the URL through a given proxy, to a temporary file.
+        """
+        tmp = tempfile.TemporaryFile()
+        downloaded = _download_helper(url, tmp, proxy, cancelled, progress,
+                                      cached)
+        if downloaded is None or cancelled.is_set():
+            tmp.close()
+            return None
+        return (tmp, downloaded)
+
+    # Do not wait for the aborted downloads, a dead proxy could block until
+    # its connection times out
+    executor = concurrent.futures.ThreadPoolExecutor(len(proxies))
+    try:
+        remaining = iter(proxies)
+        running = set()
+        while True:
+            # Start the download with the next proxy, if any
+            proxy = next(remaining, None)
+            if proxy is not None:
+                running.add(executor.submit(attempt, proxy))
+            elif not running:
+                # Every proxy failed
+                return None
+            done, running = concurrent.futures.wait(
+                running,
+                timeout=hedge_delay if proxy is not None else None,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result is None:
+                    continue
+                # Got a valid document, abort the other downloads
+                cancelled.set()
+                tmp, downloaded = result
+                with tmp:
+                    tmp.seek(0)
+                    shutil.copyfileobj(tmp, file_object, CHUNK_SIZE)
+                return downloaded
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False)
+
+
+def _download_to_file_object(url, file_object, proxies, hedge_delay=None,
+                             progress=None, cached=None):
+    """
+    Download a PDF or DJVU document from a url to a file object, trying \
+            the given proxies.
+
+    :param url: The URL to the PDF/DJVU document to fetch.
+    :param file_object: A writable (and seekable) binary file object.
+    :param proxies: A list of proxy strings, as described in \
+            :func:`download`.
+    :param hedge_delay: Delay before racing the next proxy, see \
+            :func:`download_to_file`.
+    :param progress: An optional progress hook, see :func:`download`.
+    :param cached: An optional dict of a cached version of the document, to \
+            revalidate. See :func:`_download_helper`.
+    :returns: A tuple of the size of the downloaded data and its associated \
+            content-type. Returns None if it was unable to download the \
+            document.
+    """
+    proxies = sort_proxies(proxies)
+    start = file_object.tell()
+    if hedge_delay is not None:
+        return _hedged_download_helper(url, file_object, proxies, hedge_delay,
+                                       progress, cached)
+    # Loop over all available connections
+    for proxy in proxies:
+        downloaded = _download_helper(url, file_object, proxy,
+                                      progress=progress, cached=cached)
+        if downloaded is not None:
+            return downloaded
+        # Drop any partially written data before trying next proxy
+        file_object.seek(start)
+        file_object.truncate()
+    return None
+
+
+def _cached_download(url, file_object, proxies, hedge_delay, progress,
+                     cache):
+    """
+    Download a PDF or DJVU document from a url to a file object, going \
+            through a local cache.
+
+    .. note::
+
+        Cached documents with an ``ETag`` or a ``Last-Modified`` date are \
+                revalidated against the server, and are used as is if it \
+                cannot be reached. Other cached documents are used without \
+                any request.
+
+    :param url: The URL to the PDF/DJVU document to fetch.
+    :param file_object: A writable binary file object.
+    :param proxies: A list of proxy strings, as described in \
+            :func:`download`.
+    :param hedge_delay: Delay before racing the next proxy, see \
+            :func:`download_to_file`.
+    :param progress: An optional progress hook, see :func:`download`.
+    :param cache: A :class:`libbmc.cache.DownloadCache` object.
+    :returns: A tuple of the size of the downloaded data and its associated \
+            content-type. Returns None if it was unable to download the \
+            document.
+    """
+    cached = cache.lookup(url)
+    if cached is not None and not (cached["etag"] or cached["last_modified"]):
+        # Nothing to revalidate the cached document with, use it as is
+        path = cached["path"]
+        downloaded = (cached["size"], cached["contenttype"])
+    else:
+        validators = dict(cached) if cached is not None else {}
+        # Download to a temporary file in the cache directory, to be able to
+        # move it in the cache afterwards
+        fd, tmp_path = tempfile.mkstemp(dir=cache.directory)
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                downloaded = _download_to_file_object(
+                    url, fh, proxies, hedge_delay, progress, validators)
+            if downloaded is not None and not validators.get("not_modified"):
+                path = cache.store(url, tmp_path, downloaded[1],
+                                   validators.get("etag"),
+                                   validators.get("last_modified"))
+            elif cached is not None:
+                # Document did not change, or the server could not be
+                # reached
+                path = cached["path"]
+                downloaded = (cached["size"], cached["contenttype"])
+            else:
+                return None
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    with open(path, "rb") as fh:
+        shutil.copyfileobj(fh, file_object, CHUNK_SIZE)
+    return downloaded
+
+
+def download_to_file(url, destination, proxies=None, hedge_delay=None,
+                     progress=None, cache=None):
+    """
+    Download a PDF or DJVU document from a url, eventually using proxies, \
+            and stream it to a file, without keeping it in memory.
 
     :params url: The URL to the PDF/DJVU document to fetch.
+    :params destination: Either a path to the file to write or a writable \
+            (and seekable) binary file object.
     :params proxies: An optional list of proxies to use. Proxies will be \
             used sequentially. Proxies should be a list of proxy strings. \
             Do not forget to include ``""`` (empty string) in the list if \
-            you want to try direct fetching without any proxy.
+            you want to try direct fetching without any proxy. Proxies \
+            which kept failing in previous calls are tried last, or \
+            skipped (see :func:`sort_proxies`).
+    :params hedge_delay: If set, do not wait for a proxy to fail before \
+            trying the next one, but start the next one after \
+            ``hedge_delay`` seconds. The first valid document is kept. \
+            Defaults to ``None``, that is proxies are used sequentially.
+    :params progress: An optional progress hook, see :func:`download`.
+    :params cache: An optional :class:`libbmc.cache.DownloadCache` object. \
+            If provided, documents are fetched from this cache when \
+            possible, and newly downloaded documents are stored in it.
 
-    :returns: A tuple of the raw content of the downloaded data and its \
-            associated content-type. Returns ``(None, None)`` if it was \
-            unable to download the document.
+    :returns: A tuple of the size of the downloaded data and its associated \
+            content-type. Returns ``(None, None)`` if it was unable to \
+            download the document. In this case, the ``destination`` file \
+            is removed if it was given as a path.
 
-    >>> download("http://arxiv.org/pdf/1312.4006.pdf") # doctest: +SKIP
+    >>> download_to_file("http://arxiv.org/pdf/1312.4006.pdf", "/tmp/1312.4006.pdf") # doctest: +SKIP
     """
     # Handle default argument
     if proxies is None:
         proxies = [""]
 
-    # Loop over all available connections
-    for proxy in proxies:
-        # Handle no proxy case
-        if proxy == "":
-            socket.socket = DEFAULT_SOCKET
-        # Handle SOCKS proxy
-        elif proxy.startswith('socks'):
-            if proxy[5] == '4':
-                proxy_type = socks.SOCKS4
-            else:
-                proxy_type = socks.SOCKS5
-            proxy = proxy[proxy.find('://') + 3:]
-            try:
-                proxy, port = proxy.split(':')
-            except ValueError:
-                port = None
-            socks.set_default_proxy(proxy_type, proxy, port)
-            socket.socket = socks.socksocket
-        # Handle generic HTTP proxy
+    # Handle path or file object
+    if isinstance(destination, str):
+        file_object = open(destination, "wb")
+    else:
+        file_object = destination
+
+    try:
+        if cache is None:
+            downloaded = _download_to_file_object(url, file_object, proxies,
+                                                  hedge_delay, progress)
         else:
-            try:
-                proxy, port = proxy.split(':')
-            except ValueError:
-                port = None
-            socks.set_default_proxy(socks.HTTP, proxy, port)
-            socket.socket = socks.socksocket
+            downloaded = _cached_download(url, file_object, proxies,
+                                          hedge_delay, progress, cache)
+        if downloaded is not None:
+            return downloaded
+    finally:
+        if file_object is not destination:
+            file_object.close()
+
+    # In case of running out of proxies, return (None, None)
+    if file_object is not destination:
+        os.remove(destination)
+    return (None, None)
+
+
+def _get_size(path):
+    """
+    Get the size of a file.
+
+    :param path: The path to the file.
+    :returns: The size of the file, or 0 if it does not exist.
+    """
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
 
-        downloaded = _download_helper(url)
+def _resume_helper(url, part_path, proxy, byte_range=None, progress=None):
+    """
+    Handle the download of an URL to a partial file, using the given proxy \
+            and resuming from the data already in the partial file.
+
+    :param url: The URL to download.
+    :param part_path: The path to the partial file.
+    :param proxy: A proxy string, as described in :func:`download`.
+    :param byte_range: An optional ``(start, end)`` tuple of the (inclusive) \
+            byte range of the document to download. Defaults to the whole \
+            document.
+    :param progress: An optional progress hook, see :func:`download`.
+    :returns: A tuple of the size of the complete partial file and the \
+            associated content-type (``None`` if the byte range was already \
+            complete). Returns None if it was unable to download it.
+    """
+    start, end = byte_range if byte_range is not None else (0, None)
+    offset = _get_size(part_path)
+    if end is not None and start + offset > end:
+        # Byte range is already complete
+        return (offset, None)
+    # Ask for the raw data, to be able to check the length
+    headers = {"Accept-Encoding": "identity"}
+    if start + offset > 0 or end is not None:
+        headers["Range"] = "bytes=%d-%s" % (start + offset,
+                                            end if end is not None else "")
+    report = _ProgressReporter(progress, url, proxy, byte_range)
+    try:
+        with network.get_session(proxy).get(url, stream=True,
+                                     headers=headers) as request:
+            _record_proxy_health(proxy, True)
+            if request.status_code == 416:
+                try:
+                    # "bytes */total"
+                    total = int(
+                        request.headers["content-range"].split("/")[1])
+                except (KeyError, IndexError, ValueError):
+                    total = None
+                if byte_range is None and offset > 0 and offset == total:
+                    # Partial file is already complete, the download was
+                    # interrupted before renaming it
+                    with open(part_path, "rb") as fh:
+                        contenttype = _get_contenttype({}, fh.read(16))
+                    if contenttype is not None:
+                        report("finished", offset, total)
+                        return (offset, contenttype)
+                # Partial file does not match the document anymore, drop it
+                try:
+                    os.remove(part_path)
+                except FileNotFoundError:
+                    pass
+                return None
+            if request.status_code == 206:
+                # Server honored our range request, append to the file
+                mode = "ab"
+                try:
+                    content_range = request.headers["content-range"]
+                    first_byte = int(content_range.split()[1].split("-")[0])
+                    total = int(content_range.split("/")[1])
+                except (KeyError, IndexError, ValueError):
+                    return None
+                if first_byte != start + offset:
+                    return None
+                if end is not None:
+                    total = end + 1
+            elif request.status_code == 200 and byte_range is None:
+                # Server sent the whole document, start over
+                mode = "wb"
+                try:
+                    total = int(request.headers["content-length"])
+                except (KeyError, ValueError):
+                    total = None
+            else:
+                return None
+
+            contenttype = _get_contenttype(request.headers)
+            if (contenttype is None and
+                    not _is_generic_contenttype(request.headers)):
+                return None
+            chunks = request.iter_content(RESUME_CHUNK_SIZE)
+            first_chunk = next(chunks, b"")
+            if contenttype is None and start == 0:
+                # Guess the type of the document from its first bytes
+                first_bytes = first_chunk
+                if mode == "ab":
+                    with open(part_path, "rb") as fh:
+                        first_bytes = fh.read(16)
+                contenttype = _get_contenttype(request.headers, first_bytes)
+            if contenttype is None:
+                return None
+
+            expected = total - start if total is not None else None
+            with open(part_path, mode) as fh:
+                doc_size = fh.tell()
+                report("started", doc_size, expected)
+                for buf in itertools.chain([first_chunk], chunks):
+                    fh.write(buf)
+                    doc_size += len(buf)
+                    report("progress", doc_size, expected)
+    except ValueError:
+        # Invalid URL, do not blame the proxy
+        return None
+    except (RequestException, urllib3.exceptions.HTTPError):
+        _record_proxy_health(proxy, False)
+        return None
+
+    # Check the length of the downloaded data
+    size = _get_size(part_path)
+    if total is not None and size + start != total:
+        if size + start > total:
+            # Corrupted partial file, drop it
+            os.remove(part_path)
+        return None
+    report("finished", size, expected)
+    return (size, contenttype)
+
+
+def _resume_with_retries(url, part_path, proxy, max_retries,
+                         byte_range=None, progress=None):
+    """
+    Handle the download of an URL to a partial file, resuming it as long as \
+            some progress is made.
+
+    :param url: The URL to download.
+    :param part_path: The path to the partial file.
+    :param proxy: A proxy string, as described in :func:`download`.
+    :param max_retries: Maximum number of times to resume the download.
+    :param byte_range: An optional ``(start, end)`` tuple of the byte range \
+            of the document to download.
+    :param progress: An optional progress hook, see :func:`download`.
+    :returns: A tuple of the size of the partial file and the associated \
+            content-type. Returns None if it was unable to download it.
+    """
+    for _ in range(max_retries + 1):
+        offset = _get_size(part_path)
+        downloaded = _resume_helper(url, part_path, proxy, byte_range,
+                                    progress)
         if downloaded is not None:
             return downloaded
+        if _get_size(part_path) <= offset:
+            # No progress was made, give up with this proxy
+            return None
+    return None
+
+
+def _get_byte_ranges(url, proxy, segments):
+    """
+    Split a document in byte ranges, to download them in parallel.
+
+    :param url: The URL of the document.
+    :param proxy: A proxy string, as described in :func:`download`.
+    :param segments: Number of byte ranges to split the document into.
+    :returns: A tuple of the content-type of the document and a list of \
+            ``(start, end)`` inclusive byte ranges. Returns ``(None, None)`` \
+            if the server does not support range requests.
+    """
+    try:
+        request = network.get_session(proxy).head(
+            url, allow_redirects=True,
+            headers={"Accept-Encoding": "identity"})
+    except ValueError:
+        return (None, None)
+    except (RequestException, urllib3.exceptions.HTTPError):
+        _record_proxy_health(proxy, False)
+        return (None, None)
+    _record_proxy_health(proxy, True)
+    contenttype = _get_contenttype(request.headers)
+    if (request.status_code != 200 or
+            request.headers.get("accept-ranges") != "bytes" or
+            contenttype is None):
+        return (None, None)
+    try:
+        total = int(request.headers["content-length"])
+    except (KeyError, ValueError):
+        return (None, None)
+    if total == 0:
+        return (None, None)
+    segment_size = -(-total // segments)
+    return (contenttype,
+            [(start, min(start + segment_size, total) - 1)
+             for start in range(0, total, segment_size)])
+
+
+def download_resumable(url, path, proxies=None, max_retries=3, segments=1,
+                       progress=None):
+    """
+    Download a PDF or DJVU document from a url to a file, eventually using \
+            proxies, resuming the download after any network error.
+
+    .. note::
+
+        Data is downloaded to a ``.part`` file next to ``path``, which is \
+                renamed once the document is complete and its length \
+                matches the ``Content-Length`` announced by the server. \
+                Calling this function again after an interruption resumes \
+                the download where it stopped, using HTTP range requests.
+
+    :params url: The URL to the PDF/DJVU document to fetch.
+    :params path: The path to the file to write.
+    :params proxies: An optional list of proxies to use. See \
+            :func:`download_to_file`.
+    :params max_retries: Maximum number of times to resume the download \
+            through the same proxy, as long as some progress is made.
+    :params segments: If greater than 1 and the server supports range \
+            requests, the document is split in this number of byte \
+            ranges, downloaded in parallel (each one in its own resumable \
+            ``.part`` file).
+    :params progress: An optional progress hook, see :func:`download`. \
+            Each byte range reports its own events.
+
+    :returns: A tuple of the size of the downloaded data and its associated \
+            content-type. Returns ``(None, None)`` if it was unable to \
+            download the document.
+
+    >>> download_resumable("http://arxiv.org/pdf/1312.4006.pdf", "/tmp/1312.4006.pdf") # doctest: +SKIP
+    """
+    # Handle default argument
+    if proxies is None:
+        proxies = [""]
+
+    part_path = "%s.part" % (path,)
+    for proxy in sort_proxies(proxies):
+        byte_ranges = None
+        if segments > 1 and not os.path.isfile(part_path):
+            contenttype, byte_ranges = _get_byte_ranges(url, proxy, segments)
+
+        if byte_ranges is None:
+            downloaded = _resume_with_retries(url, part_path, proxy,
+                                              max_retries, progress=progress)
+            if downloaded is None:
+                continue
+        else:
+            # Each byte range gets its own partial file, named after the
+            # range so that it can be resumed by any later call.
+            segment_paths = ["%s%d-%d" % (part_path, start, end)
+                             for start, end in byte_ranges]
+            with concurrent.futures.ThreadPoolExecutor(
+                    len(byte_ranges)) as executor:
+                results = list(executor.map(
+                    lambda args: _resume_with_retries(url, args[0], proxy,
+                                                      max_retries, args[1],
+                                                      progress),
+                    zip(segment_paths, byte_ranges)))
+            if None in results:
+                continue
+            # Concatenate the byte ranges
+            with open(part_path, "wb") as output:
+                for segment_path in segment_paths:
+                    with open(segment_path, "rb") as fh:
+                        shutil.copyfileobj(fh, output, CHUNK_SIZE)
+            for segment_path in segment_paths:
+                os.remove(segment_path)
+            downloaded = (_get_size(part_path), contenttype)
+
+        os.replace(part_path, path)
+        return downloaded
 
     # In case of running out of proxies, return (None, None)
     return (None, None)
+
+
+def download(url, proxies=None, hedge_delay=None, progress=None,
+             cache=None):
+    """
+    Download a PDF or DJVU document from a url, eventually using proxies.
+
+    .. note::
+
+        The whole document is kept in memory. Use :func:`download_to_file` \
+                to stream large documents to disk instead.
+
+    :params url: The URL to the PDF/DJVU document to fetch.
+    :params proxies: An optional list of proxies to use. Proxies will be \
+            used sequentially. Proxies should be a list of proxy strings. \
+            Do not forget to include ``""`` (empty string) in the list if \
+            you want to try direct fetching without any proxy.
+    :params hedge_delay: If set, start the download with the next proxy \
+            after this delay (in seconds), without waiting for the current \
+            one to fail. See :func:`download_to_file`.
+    :params progress: An optional progress hook, called with a dict \
+            describing each progress event. Keys are ``url``, ``proxy``, \
+            ``byte_range`` (for ranged downloads), ``status`` \
+            (``started`` when the response headers are received, \
+            ``progress`` after each chunk and ``finished`` at the end), \
+            ``downloaded`` and ``size`` (in bytes, ``size`` being ``None`` \
+            if unknown), ``received`` (in bytes received by this request, \
+            while ``downloaded`` includes the bytes of a resumed \
+            download), ``elapsed`` (in seconds since the request was \
+            sent), ``ttfb`` (time to first byte, in seconds) and ``speed`` \
+            (of this request, in bytes/s). Defaults to ``None``, that is \
+            silent. Use :func:`stdout_progress` to get a progress bar on \
+            stdout.
+    :params cache: An optional :class:`libbmc.cache.DownloadCache` object. \
+            See :func:`download_to_file`.
+
+    :returns: A tuple of the raw content of the downloaded data and its \
+            associated content-type. Returns ``(None, None)`` if it was \
+            unable to download the document.
+
+    >>> download("http://arxiv.org/pdf/1312.4006.pdf") # doctest: +SKIP
+    """
+    with io.BytesIO() as file_object:
+        _, contenttype = download_to_file(url, file_object, proxies,
+                                          hedge_delay, progress, cache)
+        if contenttype is None:
+            return (None, None)
+        return (file_object.getvalue(), contenttype)
+
+
+def download_many(urls, proxies=None, max_workers=8, per_host_limit=2,
+                  hedge_delay=None, progress=None, cache=None):
+    """
+    Download many PDF or DJVU documents concurrently, eventually using \
+            proxies.
+
+    :params urls: An iterable of URLs to the PDF/DJVU documents to fetch. \
+            Items can also be ``(url, destination)`` tuples, in which case \
+            the document is streamed to ``destination`` (see \
+            :func:`download_to_file`) instead of being kept in memory.
+    :params proxies: An optional list of proxies to use, for each \
+            document. See :func:`download`.
+    :params max_workers: Maximum number of concurrent downloads.
+    :params per_host_limit: Maximum number of concurrent downloads from the \
+            same host.
+    :params hedge_delay: Delay before racing the next proxy, for each \
+            document. See :func:`download_to_file`.
+    :params progress: An optional progress hook, see :func:`download`. \
+            It is called from the worker threads.
+    :params cache: An optional :class:`libbmc.cache.DownloadCache` object. \
+            See :func:`download_to_file`.
+
+    :returns: A generator of ``(url, result)`` tuples, yielded as soon as \
+            each download is over. ``url`` is the item from ``urls`` and \
+            ``result`` is the return value of :func:`download` (resp. \
+            :func:`download_to_file`) for this item. A download raising an \
+            exception (e.g. a missing destination directory) does not stop \
+            the others, and its result is ``(None, None)``.
+
+    >>> list(download_many(["http://arxiv.org/pdf/1312.4006.pdf"])) # doctest: +SKIP
+    """
+    def fetch(item):
+        """
+        Download a single item from ``urls``.
+        """
+        if isinstance(item, tuple):
+            return download_to_file(item[0], item[1], proxies, hedge_delay,
+                                    progress, cache)
+        return download(item, proxies, hedge_delay, progress, cache)
+
+    def host(item):
+        """
+        Get the host of a single item from ``urls``.
+        """
+        if isinstance(item, tuple):
+            item = item[0]
+        return urllib.parse.urlsplit(item).netloc
+
+    for item, result in tools.concurrent_map(fetch, urls,
+                                             max_workers=max_workers,
+                                             key=host,
+                                             per_key_limit=per_host_limit,
+                                             return_exceptions=True):
+        if isinstance(result, Exception):
+            result = (None, None)
+        yield (item, result)
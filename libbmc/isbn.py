@@ -1,14 +1,20 @@
 """
 This file contains all the ISBN-related functions.
 """
-import isbnlib
+import re
 
 from libbmc import doi
+from libbmc import tools
 
-from libbmc import __valid_identifiers__
+# isbnlib is loaded on first use
+isbnlib = tools.lazy_import("isbnlib")
 
-# Append ISBN to the valid identifiers list
-__valid_identifiers__ += ["isbn"]
+
+# ISBN-like strings, same as the "normal" level of ``isbnlib.get_isbnlike``.
+# Matches should be checked with ``isbnlib.get_canonical_isbn``.
+REGEX = re.compile(r"97[89]{1}-?[0-9]{10}|97[89]{1}-[-0-9]{13}|"
+                   r"\d{9}[0-9X]{1}|[-0-9X]{10,16}",
+                   re.IGNORECASE)
 
 
 def is_valid(isbn_id):
@@ -60,8 +66,8 @@ def extract_from_text(text):
     ['9783161484100', '9783161484100', '9783161484100', '0136091814', '123456789X']
     """
     isbns = [isbnlib.get_canonical_isbn(isbn)
-             for isbn in isbnlib.get_isbnlike(text)]
-    return [i for i in isbns if i is not None]
+             for isbn in REGEX.findall(text)]
+    return [i for i in isbns if i]
 
 
 def get_bibtex(isbn_identifier):
@@ -85,6 +91,22 @@ def get_bibtex(isbn_identifier):
     return bibtex
 
 
+def get_bibtex_many(isbn_identifiers, max_workers=8):
+    """
+    Get BibTeX strings for many ISBNs, concurrently.
+
+    .. note::
+
+        See :func:`get_bibtex`.
+
+    :param isbn_identifiers: An iterable of ISBNs to fetch BibTeX entries for.
+    :param max_workers: Maximum number of concurrent requests.
+    :returns: A dict mapping each ISBN to its BibTeX string, or ``None``.
+    """
+    return dict(tools.concurrent_map(get_bibtex, isbn_identifiers,
+                                     max_workers=max_workers))
+
+
 def to_doi(isbn_identifier):
     """
     Make a DOI out of the given ISBN.
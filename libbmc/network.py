@@ -0,0 +1,176 @@
+"""
+This file contains the shared HTTP session layer, used by all the functions
+fetching data from the network. Sessions keep connections alive, and apply
+default timeouts and retries with exponential backoff.
+"""
+import threading
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# Default settings of the sessions, see :func:`configure`
+SETTINGS = {
+    # (connect, read) timeouts, in seconds
+    "timeout": (10, 60),
+    # Number of retries of failed requests
+    "retries": 3,
+    # Backoff factor between retries, in seconds
+    "backoff_factor": 0.5,
+    # Number of connections kept alive per host
+    "pool_maxsize": 10
+}
+# HTTP status codes for which requests are retried
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Shared sessions, keyed by proxy string
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+class _TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    An HTTP adapter applying a default timeout to the requests.
+
+    :param timeout: The default timeout, as accepted by :mod:`requests`.
+    """
+    def __init__(self, timeout, *args, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def configure(**settings):
+    """
+    Update the settings of the shared sessions.
+
+    .. note::
+
+        Existing sessions are closed, and new ones are created with the new \
+                settings on next use.
+
+    :param settings: Any of the keys of ``SETTINGS``, that is ``timeout`` \
+            (a number of seconds or a ``(connect, read)`` tuple), \
+            ``retries``, ``backoff_factor`` and ``pool_maxsize``.
+    """
+    for key in settings:
+        if key not in SETTINGS:
+            raise TypeError("Unknown setting: %s" % (key,))
+    with _SESSIONS_LOCK:
+        SETTINGS.update(settings)
+        for session in _SESSIONS.values():
+            session.close()
+        _SESSIONS.clear()
+
+
+def proxy_url(proxy):
+    """
+    Convert a proxy string to a proxy URL understood by :mod:`requests`.
+
+    :param proxy: A proxy string, either ``""`` for direct connection, \
+            ``socks4://host:port``, ``socks5://host:port`` or \
+            ``host:port`` for an HTTP proxy.
+    :returns: The matching proxy URL, or ``None`` for direct connection.
+
+    >>> proxy_url("") is None
+    True
+
+    >>> proxy_url("socks5://localhost:9050")
+    'socks5h://localhost:9050'
+
+    >>> proxy_url("socks4://localhost:9050")
+    'socks4a://localhost:9050'
+
+    >>> proxy_url("localhost:3128")
+    'http://localhost:3128'
+    """
+    # Handle no proxy case
+    if proxy == "":
+        return None
+    # Handle SOCKS proxy, resolving host names through the proxy
+    elif proxy.startswith('socks'):
+        if proxy[5] == '4':
+            scheme = 'socks4a'
+        else:
+            scheme = 'socks5h'
+        return "%s://%s" % (scheme, proxy[proxy.find('://') + 3:])
+    # Handle generic HTTP proxy
+    else:
+        return "http://%s" % (proxy,)
+
+
+def get_session(proxy=""):
+    """
+    Get the shared HTTP session bound to a given proxy, creating it if \
+            needed.
+
+    .. note::
+
+        Sessions are shared between threads, so that connections to the \
+                same host through the same proxy are kept alive and reused.
+
+    :param proxy: A proxy string, see :func:`proxy_url`. Defaults to direct \
+            connection.
+    :returns: A ``requests.Session`` object.
+    """
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(proxy)
+        if session is None:
+            session = requests.Session()
+            adapter = _TimeoutHTTPAdapter(
+                SETTINGS["timeout"],
+                pool_connections=SETTINGS["pool_maxsize"],
+                pool_maxsize=SETTINGS["pool_maxsize"],
+                max_retries=Retry(
+                    total=SETTINGS["retries"],
+                    backoff_factor=SETTINGS["backoff_factor"],
+                    status_forcelist=RETRY_STATUSES,
+                    raise_on_status=False))
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            url = proxy_url(proxy)
+            if url is not None:
+                # Do not let environment proxies override the requested one
+                session.trust_env = False
+                session.proxies = {"http": url, "https": url}
+            _SESSIONS[proxy] = session
+        return session
+
+
+def get(url, **kwargs):
+    """
+    Send a GET request through the shared session.
+
+    :param url: The URL to fetch.
+    :param kwargs: Extra arguments, passed to ``requests.Session.get``.
+    :returns: A ``requests.Response`` object.
+    """
+    return get_session().get(url, **kwargs)
+
+
+def head(url, **kwargs):
+    """
+    Send a HEAD request through the shared session.
+
+    :param url: The URL to fetch.
+    :param kwargs: Extra arguments, passed to ``requests.Session.head``.
+    :returns: A ``requests.Response`` object.
+    """
+    return get_session().head(url, **kwargs)
+
+
+def post(url, **kwargs):
+    """
+    Send a POST request through the shared session.
+
+    :param url: The URL to post to.
+    :param kwargs: Extra arguments, passed to ``requests.Session.post``.
+    :returns: A ``requests.Response`` object.
+    """
+    return get_session().post(url, **kwargs)
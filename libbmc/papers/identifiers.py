@@ -2,22 +2,382 @@
 This file contains various functions to fetch unique identifiers from papers
 (DOIs, arXiv id etc).
 
-Needs pdftotext and/or djvutxt installed on the machine.
+Needs djvutxt installed on the machine for DjVu files. PDF files are converted
+with pdftotext if installed, in-process with PyPDF2 otherwise.
 
 TODO: Unittests
 """
+import concurrent.futures
+import contextlib
+import functools
 import importlib
+import itertools
+import os
+import re
+import shutil
 import subprocess
-import sys
 
 from libbmc import __valid_identifiers__
+from libbmc import tools
 
-# Import all the modules associated to __valid_identifiers__
-for valid_identifier in __valid_identifiers__:
-    importlib.import_module("libbmc.%s" % (valid_identifier,))
+# PyPDF2 is loaded on first use
+PyPDF2 = tools.lazy_import("PyPDF2")
 
+# Backend converting PDF files to text, either "pdftotext" or "pypdf2".
+# Defaults to ``None``, that is pdftotext if installed, PyPDF2 otherwise.
+PDF_BACKEND = None
+# Combined regexes of the identifier types, keyed by the tuple of types
+_SCANNERS = {}
+# Flags which can be scoped to a part of a regex
+_SCOPED_FLAGS = [(re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s"),
+                 (re.VERBOSE, "x")]
 
-def find_identifiers(src):
+
+def _get_module(identifier_type):
+    """
+    Get the module associated to an identifier type, importing it on first \
+            use.
+
+    :param identifier_type: An identifier type, from \
+            ``__valid_identifiers__``.
+    :returns: The ``libbmc.<identifier_type>`` module, or ``None`` if it \
+            cannot be imported.
+    """
+    try:
+        return importlib.import_module("libbmc.%s" % (identifier_type,))
+    except ImportError:
+        return None
+
+
+def _get_scanner():
+    """
+    Get a regex matching any of the identifier types, in a single pass.
+
+    .. note::
+
+        The regex is built from the ``REGEX`` of the modules associated to \
+                ``__valid_identifiers__``, each one in a named group \
+                ``id<i>``, ``i`` being the index of the type in \
+                ``__valid_identifiers__``.
+
+    :returns: A compiled regex, or ``None`` if no identifier type has a \
+            ``REGEX``.
+    """
+    identifier_types = tuple(__valid_identifiers__)
+    scanner = _SCANNERS.get(identifier_types)
+    if scanner is None:
+        groups = []
+        for index, identifier in enumerate(identifier_types):
+            module = _get_module(identifier)
+            regex = getattr(module, "REGEX", None)
+            if regex is None:
+                continue
+            flags = "".join(letter for flag, letter in _SCOPED_FLAGS
+                            if regex.flags & flag)
+            if flags:
+                groups.append("(?P<id%d>(?%s:%s))" %
+                              (index, flags, regex.pattern))
+            else:
+                groups.append("(?P<id%d>%s)" % (index, regex.pattern))
+        scanner = re.compile("|".join(groups)) if groups else None
+        _SCANNERS[identifier_types] = scanner
+    return scanner
+
+
+def scan_identifiers(text, first=False):
+    """
+    Find the identifiers (DOI, ISBN, arXiv, HAL) in a text, scanning it only \
+            once for all the identifier types.
+
+    .. note::
+
+        Candidates matched by the combined regex are checked (and made \
+                canonical) with the ``extract_from_text`` function of the \
+                associated module.
+
+    :param text: The text to scan.
+    :param first: If ``True``, only return the most relevant identifier, \
+            that is the first identifier of the first type (in \
+            ``__valid_identifiers__`` order) found in the text. Scanning \
+            stops as soon as it is known.
+    :returns: A list of ``(type, identifier, offset)`` tuples, sorted by \
+            offset in the text.
+    """
+    scanner = _get_scanner()
+    if scanner is None:
+        return []
+    found = []
+    best = None
+    pos = 0
+    while True:
+        match = scanner.search(text, pos)
+        if match is None:
+            break
+        # Rejected candidates should not hide identifiers starting inside
+        # them, so scanning resumes right after their first character
+        pos = match.start() + 1
+        index = int(match.lastgroup[len("id"):])
+        if best is not None and index >= best[0]:
+            # Cannot be more relevant than the best one
+            continue
+        identifier = __valid_identifiers__[index]
+        module = _get_module(identifier)
+        found_id = getattr(module, "extract_from_text")(match.group(0))
+        if not found_id:
+            continue
+        pos = max(pos, match.end())
+        hit = (identifier, found_id[0], match.start())
+        if not first:
+            found.append(hit)
+            continue
+        best = (index, hit)
+        if index == 0:
+            # Most relevant type, no need to go further
+            break
+    if first:
+        return [best[1]] if best is not None else []
+    return found
+
+
+@functools.lru_cache(maxsize=None)
+def _has_pdftotext():
+    """
+    Check whether ``pdftotext`` is installed, looking for it only once.
+    """
+    return shutil.which("pdftotext") is not None
+
+
+def _get_pdf_backend():
+    """
+    Get the backend used to convert PDF files to text, see ``PDF_BACKEND``.
+
+    :returns: Either ``"pdftotext"`` or ``"pypdf2"``.
+    """
+    if PDF_BACKEND is not None:
+        return PDF_BACKEND
+    return "pdftotext" if _has_pdftotext() else "pypdf2"
+
+
+def _iter_pdf_lines(src, first_page=None, last_page=None):
+    """
+    Convert a PDF file to text in-process, with PyPDF2.
+
+    .. note::
+
+        Only the content streams of the converted pages are parsed, and no \
+                process is spawned. The layout of the text is however \
+                rougher than the one of ``pdftotext``.
+
+    :param src: Path to the PDF file.
+    :param first_page: First page to convert, starting at ``1``. Defaults \
+            to the first page of the file.
+    :param last_page: Last page to convert. Defaults to the last page of \
+            the file.
+    :returns: An iterator of the lines of text, see :func:`_iter_lines`. \
+            An empty line is yielded at the end of each page, as the form \
+            feed output by ``pdftotext``.
+    """
+    try:
+        with open(src, "rb") as fh:
+            reader = PyPDF2.PdfFileReader(fh, strict=False)
+            num_pages = reader.getNumPages()
+            if last_page is None or last_page > num_pages:
+                last_page = num_pages
+            for page_number in range((first_page or 1) - 1, last_page):
+                page = reader.getPage(page_number)
+                # extractText is deprecated since PyPDF2 1.28
+                extract_text = getattr(page, "extract_text", page.extractText)
+                for line in extract_text().splitlines():
+                    yield line.strip()
+                yield ""
+    except Exception:
+        # PyPDF2 raises all kinds of exceptions on malformed files
+        return
+
+
+def _iter_lines(src, first_page=None, last_page=None):
+    """
+    Convert a file to text, yielding the lines as soon as they are output.
+
+    .. note::
+
+        You will need to have ``djvutxt`` installed system-wide before \
+                processing DjVu files with this function. PDF files are \
+                converted by the backend from :func:`_get_pdf_backend`.
+
+    .. note::
+
+        The conversion is stopped if the iterator is not consumed until the \
+                end.
+
+    :param src: Path to the file, either a PDF or a DjVu file.
+    :param first_page: First page to convert, starting at ``1``. Defaults \
+            to the first page of the file.
+    :param last_page: Last page to convert. Defaults to the last page of \
+            the file.
+    :returns: An iterator of the lines of text, with whitespaces at the \
+            beginning and end stripped. Nothing is yielded if an error \
+            occurred, for instance if the range of pages is out of the file.
+    """
+    if src.endswith(".pdf") and _get_pdf_backend() == "pypdf2":
+        yield from _iter_pdf_lines(src, first_page, last_page)
+        return
+    elif src.endswith(".pdf"):
+        command = ["pdftotext"]
+        if first_page is not None:
+            command += ["-f", str(first_page)]
+        if last_page is not None:
+            command += ["-l", str(last_page)]
+        command += [src, "-"]
+    elif src.endswith(".djvu"):
+        command = ["djvutxt"]
+        if first_page is not None or last_page is not None:
+            command += ["--page=%s-%s" % (first_page or 1,
+                                          last_page or "$")]
+        command += [src]
+    else:
+        return
+    try:
+        totext = subprocess.Popen(command,
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.DEVNULL)
+    except OSError:
+        return
+    with totext:
+        try:
+            for line in totext.stdout:
+                yield line.decode("utf-8", "replace").strip()
+        finally:
+            if totext.poll() is None:
+                totext.terminate()
+
+
+def _get_lines(src, first_page=None, last_page=None, text_cache=None):
+    """
+    Get the lines of text of a file, from a text cache if possible.
+
+    .. note::
+
+        Without a text cache, lines are streamed, see :func:`_iter_lines`. \
+                With a text cache, missing texts are fully converted and \
+                stored in the cache.
+
+    :param src: Path to the file, either a PDF or a DjVu file.
+    :param first_page: First page to convert, starting at ``1``.
+    :param last_page: Last page to convert.
+    :param text_cache: An optional :class:`libbmc.cache.TextCache`.
+    :returns: An iterator of the lines of text, see :func:`_iter_lines`.
+    """
+    if text_cache is None:
+        yield from _iter_lines(src, first_page, last_page)
+        return
+    backend = "totext"
+    if src.endswith(".pdf") and _get_pdf_backend() == "pypdf2":
+        # Texts from PyPDF2 are laid out differently
+        backend = "pypdf2"
+    variant = "%s:%s-%s" % (backend, first_page or "", last_page or "")
+    text = text_cache.get(src, variant)
+    if text is None:
+        lines = list(_iter_lines(src, first_page, last_page))
+        # Do not cache errors
+        if lines:
+            text_cache.set(src, variant, "\n".join(lines))
+        yield from lines
+    else:
+        yield from text.split("\n")
+
+
+def _get_text(src, text_cache=None):
+    """
+    Get the text content of a file.
+
+    .. note::
+
+        You will need to have ``djvutxt`` installed system-wide before \
+                processing DjVu files with this function. PDF files are \
+                converted with ``pdftotext`` if installed, with PyPDF2 \
+                otherwise.
+
+    :param src: Path to the file, either a PDF or a DjVu file.
+    :param text_cache: An optional :class:`libbmc.cache.TextCache`.
+    :returns: The text content of the file, with whitespaces at the \
+            beginning and end of lines stripped and lines joined with a \
+            space, or ``None`` if an error occurred.
+    """
+    if not src.endswith((".pdf", ".djvu")):
+        return None
+    return ' '.join(_get_lines(src, text_cache=text_cache))
+
+
+def _iter_page_ranges(pages):
+    """
+    Get the ranges of pages to convert, doubling the number of pages \
+            converted at each step.
+
+    :param pages: The number of pages of the first range.
+    :returns: An infinite iterator of ``(first_page, last_page)`` tuples.
+
+    >>> ranges = _iter_page_ranges(2)
+    >>> [next(ranges) for _ in range(3)]
+    [(1, 2), (3, 6), (7, 14)]
+    """
+    first_page, size = 1, pages
+    while True:
+        yield (first_page, first_page + size - 1)
+        first_page += size
+        size *= 2
+
+
+def _find_first_identifier(lines):
+    """
+    Find the most relevant identifier in lines of text, as they arrive.
+
+    :param lines: An iterable of lines of text. It is not consumed further \
+            once an identifier of the most relevant type is found.
+    :returns: A ``(type, identifier)`` tuple, or ``None``.
+    """
+    best = None
+    for line in lines:
+        # Identifiers cannot span several lines, as they contain no spaces
+        found = scan_identifiers(line, first=True)
+        if not found:
+            continue
+        identifier_type, identifier_id, _ = found[0]
+        index = __valid_identifiers__.index(identifier_type)
+        if best is None or index < best[0]:
+            best = (index, (identifier_type, identifier_id))
+            if index == 0:
+                break
+    return best[1] if best is not None else None
+
+
+def find_all_identifiers(src, first=False, text_cache=None):
+    """
+    Search for all the identifiers (DOI, ISBN, arXiv, HAL) in a given file, \
+            in a single pass over its text.
+
+    .. note::
+
+        You will need to have ``djvutxt`` installed system-wide before \
+                processing DjVu files with this function. PDF files are \
+                converted with ``pdftotext`` if installed, with PyPDF2 \
+                otherwise.
+
+    :param src: Path to the file to scan.
+    :param first: If ``True``, stop at the most relevant identifier, see \
+            :func:`scan_identifiers`.
+    :param text_cache: An optional :class:`libbmc.cache.TextCache`, to \
+            avoid converting the same file again.
+    :returns: A list of ``(type, identifier, offset)`` tuples, sorted by \
+            offset in the text of the file.
+    """
+    text = _get_text(src, text_cache)
+    if text is None:
+        return []
+    return scan_identifiers(text, first=first)
+
+
+def find_identifiers(src, pages=None, text_cache=None):
     """
     Search for a valid identifier (DOI, ISBN, arXiv, HAL) in a given file.
 
@@ -29,46 +389,126 @@ def find_identifiers(src):
 
     .. note::
 
-        You will need to have ``pdftotext`` and/or ``djvutxt`` installed \
-                system-wide before processing files with this function.
+        The text is scanned as it is output by the conversion tool, which is \
+                stopped as soon as an identifier of the most relevant type \
+                is found. With ``pages``, only the first pages are \
+                converted, the identifier being usually there, and the \
+                range is widened (next ``pages``, then ``2 * pages`` pages \
+                and so on) while no identifier is found.
+
+    .. note::
+
+        You will need to have ``djvutxt`` installed system-wide before \
+                processing DjVu files with this function. PDF files are \
+                converted with ``pdftotext`` if installed, with PyPDF2 \
+                otherwise.
 
 
     :params src: Path to the file to scan.
+    :params pages: Number of pages to convert at first. Defaults to \
+            ``None``, that is the whole file at once.
+    :params text_cache: An optional :class:`libbmc.cache.TextCache`, to \
+            avoid converting the same pages again.
 
     :returns: a tuple (type, identifier) or ``(None, None)`` if not found or \
             an error occurred.
     """
-    if src.endswith(".pdf"):
-        totext = subprocess.Popen(["pdftotext", src, "-"],
-                                  stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE,
-                                  bufsize=1)
-    elif src.endswith(".djvu"):
-        totext = subprocess.Popen(["djvutxt", src],
-                                  stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE,
-                                  bufsize=1)
-    else:
+    if not src.endswith((".pdf", ".djvu")):
         return (None, None)
-
-    while totext.poll() is None:
-        extract_full = ' '.join([i.decode("utf-8").strip()
-                                 for i in totext.stdout.readlines()])
-        # Loop over all the valid identifier types
-        for identifier in __valid_identifiers__:
-            # Dynamically call the ``extract_from_text`` method for the
-            # associated module.
-            module = sys.modules.get("libbmc.%s" % (identifier,), None)
-            if module is None:
-                continue
-            found_id = getattr(module, "extract_from_text")(extract_full)
-            if found_id:
-                totext.terminate()
-                # found_id is a list of found IDs
-                return (identifier, found_id[0])
+    if pages is None:
+        page_ranges = [(None, None)]
+    else:
+        page_ranges = _iter_page_ranges(pages)
+    for first_page, last_page in page_ranges:
+        lines = _get_lines(src, first_page, last_page, text_cache)
+        with contextlib.closing(lines):
+            first_line = next(lines, None)
+            if first_line is None:
+                # Past the last page, or an error occurred
+                break
+            found = _find_first_identifier(
+                itertools.chain([first_line], lines))
+        if found is not None:
+            return found
     return (None, None)
 
 
+def _iter_tree(root, skip):
+    """
+    Walk a directory tree and yield the paths of the papers in it.
+
+    :param root: Path to the root of the tree.
+    :param skip: A container of paths to skip.
+    :returns: An iterator of the paths of the PDF and DjVu files, in a \
+            stable order.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            if path.endswith((".pdf", ".djvu")) and path not in skip:
+                yield path
+
+
+def find_identifiers_in_tree(root, workers=None, pages=None, checkpoint=None,
+                             text_cache=None):
+    """
+    Search for a valid identifier in every paper (PDF and DjVu files) of a \
+            directory tree, in parallel.
+
+    .. note::
+
+        Files are processed by :func:`find_identifiers` in a pool of \
+                ``workers`` processes, so that at most ``workers`` \
+                conversion tools run at the same time.
+
+    .. note::
+
+        With a checkpoint, one ``{"path": ..., "type": ..., "id": ...}`` \
+                JSON line is appended to the checkpoint file per processed \
+                file. Files already in the checkpoint are skipped (and not \
+                yielded), so that an interrupted run resumes where it \
+                stopped when called again.
+
+    .. note::
+
+        You will need to have ``djvutxt`` installed system-wide before \
+                processing DjVu files with this function. PDF files are \
+                converted with ``pdftotext`` if installed, with PyPDF2 \
+                otherwise.
+
+    :param root: Path to the root of the tree.
+    :param workers: Maximum number of processes. Defaults to the number of \
+            CPUs.
+    :param pages: Number of pages to convert at first, see \
+            :func:`find_identifiers`.
+    :param checkpoint: An optional path to a checkpoint file.
+    :param text_cache: An optional :class:`libbmc.cache.TextCache`, see \
+            :func:`find_identifiers`.
+    :returns: An iterator of ``(path, type, identifier)`` tuples, in \
+            completion order. ``type`` and ``identifier`` are ``None`` if \
+            not found or an error occurred.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with contextlib.ExitStack() as stack:
+        processed = set()
+        log = None
+        if checkpoint is not None:
+            log = stack.enter_context(tools.Checkpoint(checkpoint, "path"))
+            processed = log.processed
+        for path, (identifier_type, identifier_id) in tools.concurrent_map(
+                functools.partial(find_identifiers, pages=pages,
+                                  text_cache=text_cache),
+                _iter_tree(root, processed), max_workers=workers,
+                executor_class=concurrent.futures.ProcessPoolExecutor):
+            if log is not None:
+                log.append({"path": path,
+                            "type": identifier_type,
+                            "id": identifier_id})
+            yield (path, identifier_type, identifier_id)
+
+
 def get_bibtex(identifier):
     """
     Try to fetch BibTeX from a found identifier.
@@ -86,7 +526,50 @@ def get_bibtex(identifier):
         return None
 
     # Dynamically call the ``get_bibtex`` method from the associated module.
-    module = sys.modules.get("libbmc.%s" % (identifier_type,), None)
+    module = _get_module(identifier_type)
     if module is None:
         return None
     return getattr(module, "get_bibtex")(identifier_id)
+
+
+def get_bibtex_many(identifiers):
+    """
+    Try to fetch BibTeX for many found identifiers.
+
+    .. note::
+
+        Identifiers are grouped by type, and each group is handled by the \
+                ``get_bibtex_many`` function of the associated module (e.g. \
+                batched arXiv API queries, concurrent DOI requests), the \
+                groups being processed concurrently.
+
+    :param identifiers: An iterable of tuples (type, identifier), as \
+            returned by :func:`find_identifiers`.
+    :returns: A list of BibTeX strings (or ``None`` if an error occurred), \
+            in the same order as ``identifiers``.
+    """
+    identifiers = list(identifiers)
+    groups = {}
+    for identifier_type, identifier_id in identifiers:
+        if identifier_type in __valid_identifiers__:
+            groups.setdefault(identifier_type, []).append(identifier_id)
+
+    def get_group_bibtex(identifier_type):
+        """
+        Fetch BibTeX for all the identifiers of a given type.
+        """
+        module = _get_module(identifier_type)
+        if module is None:
+            return {}
+        identifier_ids = tools.remove_duplicates(groups[identifier_type])
+        if hasattr(module, "get_bibtex_many"):
+            return getattr(module, "get_bibtex_many")(identifier_ids)
+        # Dynamically call the ``get_bibtex`` method from the associated
+        # module.
+        return {identifier_id: getattr(module, "get_bibtex")(identifier_id)
+                for identifier_id in identifier_ids}
+
+    results = dict(tools.concurrent_map(get_group_bibtex, groups,
+                                        max_workers=max(len(groups), 1)))
+    return [results.get(identifier_type, {}).get(identifier_id)
+            for identifier_type, identifier_id in identifiers]
@@ -1,30 +1,31 @@
 """
 This file contains all the arXiv-related functions.
 """
+import collections
+import gzip
 import io
+import json
+import os
 import re
 import tarfile
 import xml.etree.ElementTree
 
-from urllib.error import HTTPError
+from urllib.error import URLError
 
 
-import arxiv2bib
-import bibtexparser
-import requests
-
-from requests.exceptions import RequestException
-
-
-from libbmc import __valid_identifiers__
+from libbmc import cache
 from libbmc import tools
 
-# Append arXiv to the valid identifiers list
-__valid_identifiers__ += ["repositories.arxiv"]
+# Network dependencies are loaded on first use
+arxiv2bib = tools.lazy_import("arxiv2bib")
+network = tools.lazy_import("libbmc.network")
+requests = tools.lazy_import("requests")
+urllib3 = tools.lazy_import("urllib3")
 
 
 ARXIV_IDENTIFIER_FROM_2007 = r"\d{4}\.\d{4,5}(v\d+)?"
-ARXIV_IDENTIFIER_BEFORE_2007 = r"(" + ("|".join([
+# Categories of the arXiv identifiers before 2007
+ARXIV_CATEGORIES_BEFORE_2007 = [
     "astro-ph.GA",
     "astro-ph.CO",
     "astro-ph.EP",
@@ -171,7 +172,10 @@ ARXIV_IDENTIFIER_BEFORE_2007 = r"(" + ("|".join([
     "stat.ML",
     "stat.ME",
     "stat.OT",
-    "stat.TH"])) + r")/\d+"
+    "stat.TH"]
+# Categories are matched with a trie, faster than a plain alternation
+ARXIV_IDENTIFIER_BEFORE_2007 = (
+    r"(" + tools.trie_regex(ARXIV_CATEGORIES_BEFORE_2007) + r")/\d+")
 # Regex is fully enclosed in a group for findall to match it all
 REGEX = re.compile(
     "((arxiv:)?((" + ARXIV_IDENTIFIER_FROM_2007 + ")|(" +
@@ -182,6 +186,19 @@ REGEX = re.compile(
 ARXIV_URL = "http://arxiv.org/abs/{arxiv_id}"
 # Eprint URL used to download sources
 ARXIV_EPRINT_URL = "http://arxiv.org/e-print/{arxiv_id}"
+# arXiv API URL
+ARXIV_API_URL = "http://export.arxiv.org/api/query"
+# Maximum number of arXiv IDs (resp. DOIs) per arXiv API query
+ARXIV_API_MAX_BATCH_SIZE = 200
+ARXIV_API_MAX_DOI_BATCH_SIZE = 20
+# arXiv asks for at most one API query every three seconds, see
+# https://arxiv.org/help/api/user-manual
+ARXIV_API_RATE_LIMITER = tools.RateLimiter(1 / 3)
+# Namespaces of the Atom feeds returned by the arXiv API
+ATOM_NS = "{http://www.w3.org/2005/Atom}"
+ARXIV_NS = "{http://arxiv.org/schemas/atom}"
+# Local metadata index consulted before the arXiv API, see MetadataIndex
+METADATA_INDEX = None
 
 
 def get_latest_version(arxiv_id):
@@ -203,17 +220,39 @@ def get_latest_version(arxiv_id):
     >>> get_latest_version('1506.06690')
     '1506.06690v2'
     """
-    # Get updated bibtex
-    # Trick: strip the version from the arXiv id, to query updated BibTeX for
-    # the preprint and not the specific version
-    arxiv_preprint_id = strip_version(arxiv_id)
-    updated_bibtex = bibtexparser.loads(get_bibtex(arxiv_preprint_id))
-    updated_bibtex = next(iter(updated_bibtex.entries_dict.values()))
+    return get_latest_versions([arxiv_id])[arxiv_id]
 
-    try:
-        return updated_bibtex["eprint"]
-    except KeyError:
-        return None
+
+def get_latest_versions(arxiv_ids):
+    """
+    Find the latest versions of many arXiv eprints.
+
+    .. note::
+
+        Uses arXiv API, sending one query per batch of \
+                ``ARXIV_API_MAX_BATCH_SIZE`` eprints.
+
+        The local ``METADATA_INDEX`` is consulted first, if any.
+
+    :param arxiv_ids: An iterable of (canonical) arXiv IDs to query.
+    :returns: A dict mapping each arXiv ID to the latest version of the \
+            eprint as a string, or ``None``.
+    """
+    arxiv_ids = list(arxiv_ids)
+    latest_versions = {}
+    if METADATA_INDEX is not None:
+        latest_versions.update(METADATA_INDEX.get_latest_versions(arxiv_ids))
+    arxiv_ids = [arxiv_id for arxiv_id in arxiv_ids
+                 if arxiv_id not in latest_versions]
+    # Trick: strip the version from the arXiv ids, to query the preprints and
+    # not the specific versions
+    references = _get_references([strip_version(arxiv_id)
+                                  for arxiv_id in arxiv_ids])
+    for arxiv_id in arxiv_ids:
+        reference = references[strip_version(arxiv_id)]
+        latest_versions[arxiv_id] = (reference.id if reference is not None
+                                     else None)
+    return latest_versions
 
 
 def strip_version(arxiv_id):
@@ -290,20 +329,53 @@ def get_bibtex(arxiv_id):
     >>> get_bibtex('1506.06690v1')
     "@article{1506.06690v1,\\nAuthor        = {Lucas Verney and Lev Pitaevskii and Sandro Stringari},\\nTitle         = {Hybridization of first and second sound in a weakly-interacting Bose gas},\\nEprint        = {1506.06690v1},\\nDOI           = {10.1209/0295-5075/111/40005},\\nArchivePrefix = {arXiv},\\nPrimaryClass  = {cond-mat.quant-gas},\\nAbstract      = {Using Landau's theory of two-fluid hydrodynamics we investigate the sound\\nmodes propagating in a uniform weakly-interacting superfluid Bose gas for\\nvalues of temperature, up to the critical point. In order to evaluate the\\nrelevant thermodynamic functions needed to solve the hydrodynamic equations,\\nincluding the temperature dependence of the superfluid density, we use\\nBogoliubov theory at low temperatures and the results of a perturbative\\napproach based on Beliaev diagrammatic technique at higher temperatures.\\nSpecial focus is given on the hybridization phenomenon between first and second\\nsound which occurs at low temperatures of the order of the interaction energy\\nand we discuss explicitly the behavior of the two sound velocities near the\\nhybridization point.},\\nYear          = {2015},\\nMonth         = {Jun},\\nUrl           = {http://arxiv.org/abs/1506.06690v1},\\nFile          = {1506.06690v1.pdf}\\n}"
     """
-    # Fetch bibtex using arxiv2bib module
-    try:
-        bibtex = arxiv2bib.arxiv2bib([arxiv_id])
-    except HTTPError:
-        bibtex = []
+    return get_bibtex_many([arxiv_id])[arxiv_id]
 
-    for bib in bibtex:
-        if isinstance(bib, arxiv2bib.ReferenceErrorInfo):
-            continue
-        else:
-            # Return fetched bibtex
-            return bib.bibtex()
-    # An error occurred, return None
-    return None
+
+def _get_references(arxiv_ids):
+    """
+    Fetch the references of many arXiv eprints using arxiv2bib.
+
+    .. note::
+
+        Sends one arXiv API query per batch of ``ARXIV_API_MAX_BATCH_SIZE`` \
+                eprints.
+
+    :param arxiv_ids: An iterable of canonical arXiv IDs.
+    :returns: A dict mapping each arXiv ID to its ``arxiv2bib.Reference``, \
+            or ``None`` if an error occurred.
+    """
+    references = {}
+    for batch in tools.batch(arxiv_ids, ARXIV_API_MAX_BATCH_SIZE):
+        batch = tools.remove_duplicates(list(batch))
+        ARXIV_API_RATE_LIMITER.wait()
+        try:
+            bibtex = arxiv2bib.arxiv2bib(batch)
+        except (URLError, arxiv2bib.FatalError):
+            bibtex = [None] * len(batch)
+        for arxiv_id, bib in zip(batch, bibtex):
+            if isinstance(bib, arxiv2bib.ReferenceErrorInfo):
+                bib = None
+            references[arxiv_id] = bib
+    return references
+
+
+def get_bibtex_many(arxiv_ids):
+    """
+    Get BibTeX entries for many arXiv IDs.
+
+    .. note::
+
+        Using awesome https://pypi.python.org/pypi/arxiv2bib/ module, \
+                sending one arXiv API query per batch of \
+                ``ARXIV_API_MAX_BATCH_SIZE`` IDs.
+
+    :param arxiv_ids: An iterable of canonical arXiv ids to get BibTeX from.
+    :returns: A dict mapping each arXiv ID to its BibTeX string, or ``None``.
+    """
+    return {arxiv_id: (reference.bibtex() if reference is not None
+                       else None)
+            for arxiv_id, reference in _get_references(arxiv_ids).items()}
 
 
 def extract_from_text(text):
@@ -316,10 +388,10 @@ def extract_from_text(text):
     >>> sorted(extract_from_text('1506.06690 1506.06690v1 arXiv:1506.06690 arXiv:1506.06690v1 arxiv:1506.06690 arxiv:1506.06690v1 math.GT/0309136 abcdf bar1506.06690foo mare.GG/0309136'))
     ['1506.06690', '1506.06690v1', 'math.GT/0309136']
     """
-    # Remove the leading "arxiv:".
-    return tools.remove_duplicates([re.sub("arxiv:", "", i[0],
-                                           flags=re.IGNORECASE)
-                                    for i in REGEX.findall(text) if i[0] != ''])
+    # Single pass over the text, the third group being the ID without the
+    # leading "arxiv:".
+    return tools.remove_duplicates([match.group(3)
+                                    for match in REGEX.finditer(text)])
 
 
 def to_url(arxiv_ids):
@@ -363,6 +435,134 @@ def to_canonical(urls):
     return tools.map_or_apply(extract_from_text, urls)
 
 
+def _query_api(params):
+    """
+    Query the arXiv API, respecting its rate limit.
+
+    :param params: The parameters of the query.
+    :returns: The list of the entries of the returned Atom feed, as \
+            ``Element`` objects, or ``None`` if an error occurred.
+    """
+    ARXIV_API_RATE_LIMITER.wait()
+    try:
+        request = network.get(ARXIV_API_URL, params=params)
+        request.raise_for_status()
+        root = xml.etree.ElementTree.fromstring(request.content)
+    except (requests.exceptions.RequestException,
+            xml.etree.ElementTree.ParseError):
+        return None
+    return root.findall(ATOM_NS + "entry")
+
+
+def _entry_id(entry):
+    """
+    Get the arXiv ID of an entry of an arXiv API Atom feed.
+
+    :param entry: The entry, as an ``Element`` object.
+    :returns: The arXiv ID of the entry.
+    """
+    # The id is an arXiv full URL. We only want the arXiv ID part.
+    url = entry.find(ATOM_NS + "id").text
+    return url[url.find("/abs/") + 5:]
+
+
+def _strip_prefix(arxiv_id):
+    """
+    Remove the ``arXiv:`` prefix from an arXiv ID, if any.
+
+    :param arxiv_id: The arXiv ID.
+    :returns: The arXiv ID without prefix.
+
+    >>> _strip_prefix('arXiv:1506.06690v1')
+    '1506.06690v1'
+    """
+    return re.sub(r"\Aarxiv:", "", arxiv_id, flags=re.IGNORECASE)
+
+
+def _api_key(arxiv_id):
+    """
+    Normalize an arXiv ID to match it against the arXiv API results, which \
+            drop the version and the subject class of old-style IDs.
+
+    :param arxiv_id: The (canonical) arXiv ID.
+    :returns: The normalized ID.
+
+    >>> _api_key('1506.06690v1')
+    '1506.06690'
+
+    >>> _api_key('math.GT/0309136')
+    'math/0309136'
+
+    >>> _api_key('arxiv:1506.06690')
+    '1506.06690'
+    """
+    return re.sub(r"\.[a-z\-]+/", "/", strip_version(_strip_prefix(arxiv_id)),
+                  flags=re.IGNORECASE)
+
+
+def _quote_query_term(term):
+    """
+    Quote a term of an arXiv API search query, so that spaces, parentheses \
+            or boolean operators in it are not interpreted.
+
+    .. note::
+
+        The arXiv API has no way to escape double quotes in a phrase, so \
+                they are replaced by spaces. Results should be checked \
+                against the original term anyway.
+
+    :param term: The term to quote.
+    :returns: The quoted term.
+
+    >>> _quote_query_term('10.1002/(SICI)1097-0134 OR x')
+    '"10.1002/(SICI)1097-0134 OR x"'
+    """
+    return '"%s"' % (term.replace('"', ' '),)
+
+
+def from_dois(dois):
+    """
+    Get the arXiv eprint ids for many DOIs.
+
+    .. note::
+
+        Uses arXiv API, sending one query per batch of \
+                ``ARXIV_API_MAX_DOI_BATCH_SIZE`` DOIs. Will not return \
+                anything if arXiv is not aware of the associated DOI. The \
+                local ``METADATA_INDEX`` is consulted first, if any.
+
+    :param dois: An iterable of DOIs to look for.
+    :returns: A dict mapping each DOI to its arXiv eprint id, or ``None`` \
+            if not found.
+    """
+    dois = list(dois)
+    results = {}
+    if METADATA_INDEX is not None:
+        results.update(METADATA_INDEX.from_dois(dois))
+    missing = [doi for doi in dois if doi not in results]
+    for dois_batch in tools.batch(missing, ARXIV_API_MAX_DOI_BATCH_SIZE):
+        # DOIs are case insensitive, keep all the spellings asked for
+        batch = collections.defaultdict(list)
+        for doi in dois_batch:
+            batch[doi.lower()].append(doi)
+            results[doi] = None
+        entries = _query_api({
+            "search_query": " OR ".join(
+                "doi:%s" % (_quote_query_term(spellings[0]),)
+                for spellings in batch.values()),
+            # Leave room for several preprints with the same DOI
+            "max_results": 2 * len(batch)
+        })
+        for entry in entries or []:
+            doi = entry.find(ARXIV_NS + "doi")
+            if doi is None or doi.text.lower() not in batch:
+                continue
+            for spelling in batch[doi.text.lower()]:
+                if results[spelling] is None:
+                    results[spelling] = _entry_id(entry)
+    return results
+
+
 def from_doi(doi):
     """
     Get the arXiv eprint id for a given DOI.
@@ -379,22 +579,51 @@ def from_doi(doi):
     # Note: Test do not pass due to an arXiv API bug.
     '1506.06690'
     """
-    try:
-        request = requests.get("http://export.arxiv.org/api/query",
-                               params={
-                                   "search_query": "doi:%s" % (doi,),
-                                   "max_results": 1
-                               })
-        request.raise_for_status()
-    except RequestException:
-        return None
-    root = xml.etree.ElementTree.fromstring(request.content)
-    for entry in root.iter("{http://www.w3.org/2005/Atom}entry"):
-        arxiv_id = entry.find("{http://www.w3.org/2005/Atom}id").text
-        # arxiv_id is an arXiv full URL. We only want the id which is the last
-        # URL component.
-        return arxiv_id.split("/")[-1]
-    return None
+    return from_dois([doi])[doi]
+
+
+def to_dois(arxiv_ids):
+    """
+    Get the associated DOIs for many arXiv eprints.
+
+    .. note::
+
+        Uses arXiv API, sending one query per batch of \
+                ``ARXIV_API_MAX_BATCH_SIZE`` eprints. Will not return \
+                anything if arXiv is not aware of the associated DOI. The \
+                local ``METADATA_INDEX`` is consulted first, if any.
+
+    :param arxiv_ids: An iterable of arXiv eprint ids.
+    :returns: A dict mapping each arXiv eprint id to its DOI, or ``None``.
+    """
+    arxiv_ids = list(arxiv_ids)
+    results = {}
+    if METADATA_INDEX is not None:
+        results.update(METADATA_INDEX.to_dois(arxiv_ids))
+    missing = [arxiv_id for arxiv_id in arxiv_ids if arxiv_id not in results]
+    for batch in tools.batch(missing, ARXIV_API_MAX_BATCH_SIZE):
+        keys = {}
+        for arxiv_id in batch:
+            results[arxiv_id] = None
+            # Invalid IDs make the whole query fail
+            if is_valid(arxiv_id):
+                keys.setdefault(_api_key(arxiv_id), []).append(arxiv_id)
+        if not keys:
+            continue
+        # The API rejects prefixed IDs
+        queried_ids = tools.remove_duplicates(
+            [_strip_prefix(i) for ids in keys.values() for i in ids])
+        entries = _query_api({
+            "id_list": ",".join(queried_ids),
+            "max_results": len(queried_ids)
+        })
+        for entry in entries or []:
+            doi = entry.find(ARXIV_NS + "doi")
+            if doi is None:
+                continue
+            for arxiv_id in keys.get(_api_key(_entry_id(entry)), []):
+                results[arxiv_id] = doi.text
+    return results
 
 
 def to_doi(arxiv_id):
@@ -415,21 +644,7 @@ def to_doi(arxiv_id):
     >>> to_doi('1506.06690')
     '10.1209/0295-5075/111/40005'
     """
-    try:
-        request = requests.get("http://export.arxiv.org/api/query",
-                               params={
-                                   "id_list": arxiv_id,
-                                   "max_results": 1
-                               })
-        request.raise_for_status()
-    except RequestException:
-        return None
-    root = xml.etree.ElementTree.fromstring(request.content)
-    for entry in root.iter("{http://www.w3.org/2005/Atom}entry"):
-        doi = entry.find("{http://arxiv.org/schemas/atom}doi")
-        if doi is not None:
-            return doi.text
-    return None
+    return to_dois([arxiv_id])[arxiv_id]
 
 
 def get_sources(arxiv_id):
@@ -447,14 +662,130 @@ def get_sources(arxiv_id):
             ``None``.
     """
     try:
-        request = requests.get(ARXIV_EPRINT_URL.format(arxiv_id=arxiv_id))
+        request = network.get(ARXIV_EPRINT_URL.format(arxiv_id=arxiv_id))
         request.raise_for_status()
         file_object = io.BytesIO(request.content)
         return tarfile.open(fileobj=file_object)
-    except (RequestException, AssertionError, tarfile.TarError):
+    except (requests.exceptions.RequestException, AssertionError,
+            tarfile.TarError):
         return None
 
 
+def iter_bbl_from_stream(file_object):
+    """
+    Extract the .bbl files from a stream of arXiv sources.
+
+    .. note::
+
+        The stream is read sequentially, only ``.bbl`` members being kept \
+                in memory. Compression is detected on the fly. Sources \
+                which are not a tarball (single-file gzip e-prints, PDF \
+                only submissions) do not yield anything.
+
+    :param file_object: A readable file object of the sources, as served \
+            on arXiv (possibly gzip compressed tarball).
+    :returns: An iterator of the full text of the ``.bbl`` files.
+    """
+    try:
+        with tarfile.open(fileobj=file_object, mode="r|*") as tar_file:
+            for member in tar_file:
+                if not member.isfile() or not member.name.endswith(".bbl"):
+                    continue
+                yield (tar_file.extractfile(member).read()
+                       .decode(tarfile.ENCODING, "replace"))
+    except tarfile.ReadError:
+        # Not a tarball
+        return
+
+
+def _dump_name_to_id(name):
+    """
+    Get the arXiv ID from the name of a file in an arXiv bulk source dump.
+
+    :param name: The file name, without the ``.gz`` extension.
+    :returns: The canonical arXiv ID.
+
+    >>> _dump_name_to_id('1501.00001')
+    '1501.00001'
+
+    >>> _dump_name_to_id('astro-ph0001001')
+    'astro-ph/0001001'
+    """
+    return re.sub(r"\A([a-z\-]+)(\d{7})\Z", r"\1/\2", name,
+                  flags=re.IGNORECASE)
+
+
+def iter_bbl_from_dump(dump, skip=None):
+    """
+    Walk an arXiv bulk source dump on disk and extract the .bbl files of \
+            each preprint.
+
+    .. note::
+
+        Dumps are the tarballs of sources available from arXiv bulk data on \
+                Amazon S3, see http://arxiv.org/help/bulk_data_s3. They are \
+                read sequentially, without extracting them on disk, and no \
+                network access is needed.
+
+    :param dump: Either the path to a dump tarball (e.g. \
+            ``arXiv_src_1501_001.tar``) or the path to a directory of dump \
+            tarballs.
+    :param skip: An optional container of arXiv IDs to skip.
+    :returns: An iterator of ``(arxiv_id, bbl_files)`` tuples, \
+            ``bbl_files`` being a list of the full text of the ``.bbl`` \
+            files of the preprint.
+    """
+    if os.path.isdir(dump):
+        dump_paths = sorted(os.path.join(dump, name)
+                            for name in os.listdir(dump)
+                            if name.endswith(".tar"))
+    else:
+        dump_paths = [dump]
+    for dump_path in dump_paths:
+        with tarfile.open(dump_path, mode="r|") as dump_file:
+            for member in dump_file:
+                name = os.path.basename(member.name)
+                # PDF only submissions have no sources
+                if not member.isfile() or not name.endswith(".gz"):
+                    continue
+                arxiv_id = _dump_name_to_id(name[:-len(".gz")])
+                if skip is not None and arxiv_id in skip:
+                    continue
+                yield arxiv_id, list(iter_bbl_from_stream(
+                    dump_file.extractfile(member)))
+
+
+def iter_bbl(arxiv_id):
+    """
+    Stream the sources on arXiv for a given preprint and extract the .bbl \
+            files (if any) as they are encountered.
+
+    .. note::
+
+        Bulk download of sources from arXiv is not permitted by their API. \
+                You should have a look at http://arxiv.org/help/bulk_data_s3.
+
+    :param arxiv_id: The arXiv id (e.g. ``1401.2910`` or ``1401.2910v1``) in \
+            a canonical form.
+    :returns: An iterator of the full text of the ``.bbl`` files (if any).
+    """
+    try:
+        request = network.get(ARXIV_EPRINT_URL.format(arxiv_id=arxiv_id),
+                              stream=True)
+        request.raise_for_status()
+    except requests.exceptions.RequestException:
+        return
+    with request:
+        # Remove any transfer compression
+        request.raw.decode_content = True
+        try:
+            yield from iter_bbl_from_stream(request.raw)
+        except (requests.exceptions.RequestException,
+                urllib3.exceptions.HTTPError, OSError, EOFError):
+            # Connection lost while streaming
+            return
+
+
 def get_bbl(arxiv_id):
     """
     Get the .bbl files (if any) of a given preprint.
@@ -464,13 +795,142 @@ def get_bbl(arxiv_id):
         Bulk download of sources from arXiv is not permitted by their API. \
                 You should have a look at http://arxiv.org/help/bulk_data_s3.
 
+    .. note::
+
+        Sources are streamed, see :func:`iter_bbl`.
+
     :param arxiv_id: The arXiv id (e.g. ``1401.2910`` or ``1401.2910v1``) in \
             a canonical form.
-    :returns: A list of the full text of the ``.bbl`` files (if any) \
-            or ``None``.
-    """
-    tar_file = get_sources(arxiv_id)
-    bbl_files = [i for i in tar_file.getmembers() if i.name.endswith(".bbl")]
-    bbl_files = [tar_file.extractfile(member).read().decode(tarfile.ENCODING)
-                 for member in bbl_files]
-    return bbl_files
+    :returns: A list of the full text of the ``.bbl`` files (if any).
+    """
+    return list(iter_bbl(arxiv_id))
+
+
+class MetadataIndex(cache.SQLiteStore):
+    """
+    A local index of arXiv metadata, stored in an SQLite database, to map \
+    arXiv IDs to DOIs and latest versions without network access.
+
+    To have the functions of this module consult it before the arXiv API, \
+    set ``METADATA_INDEX`` to an instance of this class.
+
+    .. note::
+
+        The index is only as fresh as the snapshot it was built from. \
+                Preprints which are not in the index are looked up on the \
+                arXiv API as usual.
+
+    :param path: Path to the SQLite database. Created if needed.
+    """
+    def __init__(self, path):
+        super().__init__(path)
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS papers ("
+                       "arxiv_id TEXT PRIMARY KEY, "
+                       "latest_version TEXT NOT NULL, "
+                       "doi TEXT)")
+            db.execute("CREATE INDEX IF NOT EXISTS papers_doi "
+                       "ON papers (doi)")
+
+    def load_snapshot(self, snapshot_path):
+        """
+        Import an arXiv metadata snapshot in the index.
+
+        .. note::
+
+            The snapshot should be a JSON lines file (possibly gzip \
+                    compressed), with one object per preprint having at \
+                    least ``id``, ``doi`` and ``versions`` keys, as in the \
+                    arXiv metadata dataset published on Kaggle. Preprints \
+                    already in the index are updated.
+
+        :param snapshot_path: The path to the snapshot.
+        :returns: The number of imported preprints.
+        """
+        opener = gzip.open if snapshot_path.endswith(".gz") else open
+        imported = 0
+        with opener(snapshot_path, 'rt', encoding="utf-8") as fh, \
+                self._connect() as db:
+            rows = (self._parse_metadata(json.loads(line))
+                    for line in fh if line.strip())
+            for batch in tools.batch(rows, 10000):
+                batch = list(batch)
+                db.executemany("INSERT OR REPLACE INTO papers "
+                               "VALUES (?, ?, ?)", batch)
+                imported += len(batch)
+        return imported
+
+    @staticmethod
+    def _parse_metadata(metadata):
+        """
+        Get the row to insert in the index for a preprint.
+
+        :param metadata: The metadata of the preprint, as a dict.
+        :returns: A ``(arxiv_id, latest_version, doi)`` tuple.
+        """
+        arxiv_id = metadata["id"]
+        versions = metadata.get("versions") or [{"version": "v1"}]
+        doi = metadata.get("doi")
+        if doi:
+            # Several DOIs are sometimes given, keep the first one
+            doi = doi.split()[0].lower()
+        else:
+            doi = None
+        return (_api_key(arxiv_id), arxiv_id + versions[-1]["version"], doi)
+
+    def _select(self, column, key_column, keys):
+        """
+        Look up many keys in the index.
+
+        :param column: The column to fetch.
+        :param key_column: The column to match the keys against.
+        :param keys: A list of keys.
+        :returns: A dict of the keys found in the index, and the matching \
+                values of ``column``.
+        """
+        with self._connect() as db:
+            return dict(self._select_in(
+                db,
+                "SELECT %s, %s FROM papers WHERE %s IN (%%s)" %
+                (key_column, column, key_column),
+                keys))
+
+    def to_dois(self, arxiv_ids):
+        """
+        Get the DOIs of many arXiv eprints from the index.
+
+        :param arxiv_ids: A list of arXiv eprint ids.
+        :returns: A dict mapping each arXiv eprint id found in the index to \
+                its DOI, or ``None``.
+        """
+        keys = {arxiv_id: _api_key(arxiv_id) for arxiv_id in arxiv_ids}
+        found = self._select("doi", "arxiv_id", list(set(keys.values())))
+        return {arxiv_id: found[key] for arxiv_id, key in keys.items()
+                if key in found}
+
+    def from_dois(self, dois):
+        """
+        Get the arXiv eprint ids of many DOIs from the index.
+
+        :param dois: A list of DOIs.
+        :returns: A dict mapping each DOI found in the index to its arXiv \
+                eprint id, in its latest version.
+        """
+        keys = {doi: doi.lower() for doi in dois}
+        found = self._select("latest_version", "doi",
+                             list(set(keys.values())))
+        return {doi: found[key] for doi, key in keys.items() if key in found}
+
+    def get_latest_versions(self, arxiv_ids):
+        """
+        Get the latest versions of many arXiv eprints from the index.
+
+        :param arxiv_ids: A list of arXiv eprint ids.
+        :returns: A dict mapping each arXiv eprint id found in the index to \
+                its latest version.
+        """
+        keys = {arxiv_id: _api_key(arxiv_id) for arxiv_id in arxiv_ids}
+        found = self._select("latest_version", "arxiv_id",
+                             list(set(keys.values())))
+        return {arxiv_id: found[key] for arxiv_id, key in keys.items()
+                if key in found}
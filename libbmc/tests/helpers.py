@@ -0,0 +1,34 @@
+"""
+Helpers shared by the tests and the benchmarks.
+"""
+
+
+def make_pdf(pages):
+    """
+    Build a minimal PDF file, with one line of text per page.
+    """
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+                   b" ".join(b"%d 0 R" % (4 + 2 * i,)
+                             for i in range(len(pages))),
+                   len(pages)),
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    for i, text in enumerate(pages):
+        stream = b"BT /F1 10 Tf 72 720 Td (%s) Tj ET" % (text.encode(),)
+        objects.append(b"<< /Type /Page /Parent 2 0 R "
+                       b"/MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> "
+                       b"/Contents %d 0 R >>" % (5 + 2 * i,))
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" %
+                       (len(stream), stream))
+    content = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(content))
+        content += b"%d 0 obj\n%s\nendobj\n" % (number, obj)
+    xref = len(content)
+    content += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1,)
+    content += b"".join(b"%010d 00000 n \n" % (offset,) for offset in offsets)
+    content += (b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n"
+                b"%%%%EOF\n" % (len(objects) + 1, xref))
+    return content
@@ -0,0 +1,312 @@
+import gzip
+import io
+import json
+import os
+import tarfile
+import tempfile
+import unittest
+from unittest import mock
+
+import arxiv2bib
+import requests
+
+from libbmc.citations import bbl
+from libbmc.citations.repositories import arxiv as arxiv_citations
+from libbmc.repositories import arxiv
+
+
+# Atom feed returned by the fake arXiv API
+FEED = b"""<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom"
+      xmlns:arxiv="http://arxiv.org/schemas/atom">
+  <entry>
+    <id>http://arxiv.org/abs/1506.06690v2</id>
+    <arxiv:doi>10.1209/0295-5075/111/40005</arxiv:doi>
+  </entry>
+  <entry>
+    <id>http://arxiv.org/abs/1401.2910v1</id>
+    <arxiv:doi>10.1002/(SICI)1097-0134 OR x</arxiv:doi>
+  </entry>
+</feed>
+"""
+
+
+def make_response(content):
+    """
+    Build a fake response from the arXiv API.
+    """
+    response = requests.Response()
+    response.status_code = 200
+    response._content = content
+    return response
+
+
+def fake_arxiv2bib(arxiv_ids):
+    """
+    Fake ``arxiv2bib.arxiv2bib``, knowing about 1506.06690 and 1401.2910.
+    """
+    known = {"1506.06690": "1506.06690v2", "1401.2910": "1401.2910v1"}
+    references = []
+    for arxiv_id in arxiv_ids:
+        if arxiv_id in known:
+            references.append(mock.Mock(
+                id=known[arxiv_id],
+                bibtex=mock.Mock(return_value="@article{%s}" % (arxiv_id,))))
+        else:
+            references.append(arxiv2bib.ReferenceErrorInfo("not found",
+                                                           arxiv_id))
+    return references
+
+
+class TestArxivAPI(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(arxiv, "ARXIV_API_RATE_LIMITER")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_from_dois(self):
+        dois = ["10.1209/0295-5075/111/40005",
+                "10.1209/0295-5075/111/40005".upper(),
+                "10.1002/(SICI)1097-0134 OR x",
+                "10.1000/missing"]
+        with mock.patch("libbmc.network.get",
+                        return_value=make_response(FEED)) as get:
+            self.assertEqual(arxiv.from_dois(dois),
+                             {dois[0]: "1506.06690v2",
+                              dois[1]: "1506.06690v2",
+                              dois[2]: "1401.2910v1",
+                              dois[3]: None})
+        self.assertEqual(
+            get.call_args[1]["params"]["search_query"],
+            'doi:"10.1209/0295-5075/111/40005" OR '
+            'doi:"10.1002/(SICI)1097-0134 OR x" OR '
+            'doi:"10.1000/missing"')
+
+    def test_get_bibtex_many(self):
+        with mock.patch.object(arxiv, "ARXIV_API_MAX_BATCH_SIZE", 2), \
+                mock.patch("arxiv2bib.arxiv2bib",
+                           side_effect=fake_arxiv2bib) as query:
+            self.assertEqual(
+                arxiv.get_bibtex_many(["1506.06690", "1234.5678",
+                                       "1401.2910"]),
+                {"1506.06690": "@article{1506.06690}",
+                 "1234.5678": None,
+                 "1401.2910": "@article{1401.2910}"})
+        # One query per batch
+        self.assertEqual(query.call_count, 2)
+
+    def test_get_bibtex_many_error(self):
+        with mock.patch("arxiv2bib.arxiv2bib",
+                        side_effect=arxiv2bib.FatalError("down")):
+            self.assertEqual(arxiv.get_bibtex_many(["1506.06690"]),
+                             {"1506.06690": None})
+
+    def test_get_latest_versions(self):
+        with mock.patch("arxiv2bib.arxiv2bib",
+                        side_effect=fake_arxiv2bib) as query:
+            self.assertEqual(
+                arxiv.get_latest_versions(["1506.06690v1", "1506.06690",
+                                           "1234.5678v3"]),
+                {"1506.06690v1": "1506.06690v2",
+                 "1506.06690": "1506.06690v2",
+                 "1234.5678v3": None})
+        # Versions are stripped, and each eprint is queried once
+        query.assert_called_once_with(mock.ANY)
+        self.assertEqual(sorted(query.call_args[0][0]),
+                         ["1234.5678", "1506.06690"])
+
+    def test_to_dois(self):
+        arxiv_ids = ["arXiv:1506.06690", "1506.06690v1", "ARXIV:1401.2910v1",
+                     "invalid", "1234.5678"]
+        with mock.patch("libbmc.network.get",
+                        return_value=make_response(FEED)) as get:
+            self.assertEqual(
+                arxiv.to_dois(arxiv_ids),
+                {"arXiv:1506.06690": "10.1209/0295-5075/111/40005",
+                 "1506.06690v1": "10.1209/0295-5075/111/40005",
+                 "ARXIV:1401.2910v1": "10.1002/(SICI)1097-0134 OR x",
+                 "invalid": None,
+                 "1234.5678": None})
+        # Prefixes are stripped, and invalid IDs are not sent
+        self.assertEqual(
+            sorted(get.call_args[1]["params"]["id_list"].split(",")),
+            ["1234.5678", "1401.2910v1", "1506.06690", "1506.06690v1"])
+
+
+def make_tar(members, mode="w"):
+    """
+    Build a tarball in memory.
+
+    :param members: A dict mapping the names of the members to their content.
+    :returns: The content of the tarball, as bytes.
+    """
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode=mode) as tar_file:
+        for name, content in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar_file.addfile(info, io.BytesIO(content))
+    return buf.getvalue()
+
+
+def make_dump(path):
+    """
+    Write a small arXiv bulk source dump.
+    """
+    with open(path, "wb") as fh:
+        fh.write(make_tar({
+            # Gzip compressed tarball of sources, with nested folders
+            "1501/1501.00001.gz": make_tar({
+                "main.tex": b"\\documentclass{article}",
+                "sub/main.bbl": b"\\bibitem{a} First.",
+                "other.bbl": b"\\bibitem{b} Second."
+            }, mode="w:gz"),
+            # Single-file gzip e-print, without any tarball
+            "1501/astro-ph0001001.gz": gzip.compress(
+                b"\\documentclass{article}"),
+            # PDF only submission
+            "1501/1501.00002.pdf": b"%PDF-1.4",
+            "1501/1501.00003.gz": make_tar({
+                "main.bbl": b"\\bibitem{c} Third."
+            }, mode="w:gz")
+        }))
+
+
+class TestSourceStreams(unittest.TestCase):
+    def test_iter_bbl_from_stream(self):
+        sources = make_tar({"main.tex": b"tex",
+                            "a/b/main.bbl": b"\\bibitem{a} First."},
+                           mode="w:gz")
+        self.assertEqual(list(arxiv.iter_bbl_from_stream(io.BytesIO(sources))),
+                         ["\\bibitem{a} First."])
+
+    def test_iter_bbl_from_stream_not_tar(self):
+        for sources in [gzip.compress(b"\\documentclass{article}"),
+                        b"%PDF-1.4 not a tarball"]:
+            self.assertEqual(
+                list(arxiv.iter_bbl_from_stream(io.BytesIO(sources))), [])
+
+    def test_iter_bbl_from_dump(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            make_dump(os.path.join(tmpdir, "arXiv_src_1501_001.tar"))
+            for dump in [tmpdir,
+                         os.path.join(tmpdir, "arXiv_src_1501_001.tar")]:
+                self.assertEqual(
+                    list(arxiv.iter_bbl_from_dump(dump)),
+                    [("1501.00001", ["\\bibitem{a} First.",
+                                     "\\bibitem{b} Second."]),
+                     ("astro-ph/0001001", []),
+                     ("1501.00003", ["\\bibitem{c} Third."])])
+            self.assertEqual(
+                [arxiv_id for arxiv_id, _ in arxiv.iter_bbl_from_dump(
+                    tmpdir, skip={"1501.00001", "astro-ph/0001001"})],
+                ["1501.00003"])
+
+
+class TestProcessDump(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.dump = os.path.join(tmpdir.name, "arXiv_src_1501_001.tar")
+        make_dump(self.dump)
+        self.index_path = os.path.join(tmpdir.name, "index.jsonl")
+        # Do not depend on delatex, workers are forked with the patch
+        patcher = mock.patch.object(bbl, "bibitem_as_plaintext",
+                                    lambda bibitem: bibitem.strip())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _read_index(self):
+        with open(self.index_path, "r") as fh:
+            return [json.loads(line) for line in fh]
+
+    def test_process_dump(self):
+        self.assertEqual(
+            arxiv_citations.process_dump(self.dump, self.index_path,
+                                         max_workers=2), 3)
+        self.assertEqual(
+            sorted(self._read_index(), key=lambda x: x["arxiv_id"]),
+            [{"arxiv_id": "1501.00001", "citations": ["First.", "Second."]},
+             {"arxiv_id": "1501.00003", "citations": ["Third."]},
+             {"arxiv_id": "astro-ph/0001001", "citations": []}])
+
+    def test_process_dump_resume(self):
+        arxiv_citations.process_dump(self.dump, self.index_path,
+                                     max_workers=2)
+        # Simulate an interrupted run, with a truncated last line
+        with open(self.index_path, "r") as fh:
+            lines = fh.read().splitlines()
+        with open(self.index_path, "w") as fh:
+            fh.write(lines[0] + "\n" + lines[1][:10])
+        self.assertEqual(
+            arxiv_citations.process_dump(self.dump, self.index_path,
+                                         max_workers=2), 2)
+        with open(self.index_path, "r") as fh:
+            new_lines = fh.read().splitlines()
+        # The truncated line was terminated, and left behind
+        self.assertEqual(new_lines[:2], [lines[0], lines[1][:10]])
+        self.assertEqual(
+            sorted(json.loads(line)["arxiv_id"] for line in new_lines[2:]),
+            sorted(json.loads(line)["arxiv_id"] for line in lines[1:]))
+        # Nothing left to do
+        self.assertEqual(
+            arxiv_citations.process_dump(self.dump, self.index_path,
+                                         max_workers=2), 0)
+
+
+# Metadata snapshot, in the format of the arXiv dataset on Kaggle
+SNAPSHOT = [
+    {"id": "1506.06690", "doi": "10.1209/0295-5075/111/40005",
+     "versions": [{"version": "v1"}, {"version": "v2"}]},
+    {"id": "math/0309136", "doi": None, "versions": [{"version": "v1"}]},
+    {"id": "1401.2910", "doi": "10.1103/PhysRevA.89.033630 10.1000/other",
+     "versions": [{"version": "v1"}]}
+]
+
+
+class TestMetadataIndex(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.snapshot = os.path.join(tmpdir.name, "snapshot.json.gz")
+        with gzip.open(self.snapshot, "wt", encoding="utf-8") as fh:
+            for metadata in SNAPSHOT:
+                fh.write(json.dumps(metadata) + "\n")
+        self.index = arxiv.MetadataIndex(os.path.join(tmpdir.name,
+                                                      "index.sqlite"))
+
+    def test_load_snapshot(self):
+        self.assertEqual(self.index.load_snapshot(self.snapshot), 3)
+        # Loading again updates the existing preprints
+        self.assertEqual(self.index.load_snapshot(self.snapshot), 3)
+        self.assertEqual(
+            self.index.get_latest_versions(["1506.06690v1", "1506.06690",
+                                            "math.GT/0309136", "1234.5678"]),
+            {"1506.06690v1": "1506.06690v2",
+             "1506.06690": "1506.06690v2",
+             "math.GT/0309136": "math/0309136v1"})
+        self.assertEqual(
+            self.index.to_dois(["1506.06690v1", "math/0309136", "1401.2910",
+                                "1234.5678"]),
+            {"1506.06690v1": "10.1209/0295-5075/111/40005",
+             "math/0309136": None,
+             "1401.2910": "10.1103/physreva.89.033630"})
+        self.assertEqual(
+            self.index.from_dois(["10.1103/PhysRevA.89.033630",
+                                  "10.1000/missing"]),
+            {"10.1103/PhysRevA.89.033630": "1401.2910v1"})
+
+    def test_offline_lookups(self):
+        self.index.load_snapshot(self.snapshot)
+        with mock.patch.object(arxiv, "METADATA_INDEX", self.index), \
+                mock.patch("libbmc.network.get") as get:
+            self.assertEqual(
+                arxiv.get_latest_versions(["1506.06690v1"]),
+                {"1506.06690v1": "1506.06690v2"})
+            self.assertEqual(
+                arxiv.to_dois(["1506.06690v1"]),
+                {"1506.06690v1": "10.1209/0295-5075/111/40005"})
+            self.assertEqual(
+                arxiv.from_dois(["10.1209/0295-5075/111/40005"]),
+                {"10.1209/0295-5075/111/40005": "1506.06690v2"})
+        get.assert_not_called()
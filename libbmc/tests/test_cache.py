@@ -0,0 +1,69 @@
+import os
+import tempfile
+import time
+import unittest
+from libbmc.cache import TextCache
+
+
+class TestTextCache(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        self.db_path = os.path.join(self.tmpdir, "texts.sqlite")
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "wb") as fh:
+            fh.write(content)
+        return path
+
+    def test_hit_and_miss(self):
+        cache = TextCache(self.db_path)
+        path = self._write("paper.pdf", b"%PDF-1")
+        self.assertIsNone(cache.get(path, "pdftotext"))
+        cache.set(path, "pdftotext", "some text")
+        self.assertEqual(cache.get(path, "pdftotext"), "some text")
+        # Persisted across instances
+        self.assertEqual(TextCache(self.db_path).get(path, "pdftotext"),
+                         "some text")
+        self.assertIsNone(cache.get(os.path.join(self.tmpdir, "missing.pdf"),
+                                    "pdftotext"))
+
+    def test_variants(self):
+        cache = TextCache(self.db_path)
+        path = self._write("paper.pdf", b"%PDF-1")
+        cache.set(path, "totext:1-2", "first pages")
+        cache.set(path, "totext:-", "whole text")
+        self.assertEqual(cache.get(path, "totext:1-2"), "first pages")
+        self.assertEqual(cache.get(path, "totext:-"), "whole text")
+        self.assertIsNone(cache.get(path, "cermine"))
+
+    def test_content_keying(self):
+        cache = TextCache(self.db_path)
+        path = self._write("paper.pdf", b"%PDF-1")
+        cache.set(path, "pdftotext", "some text")
+        # Same content at another path
+        copy = self._write("copy.pdf", b"%PDF-1")
+        self.assertEqual(cache.get(copy, "pdftotext"), "some text")
+        # Changed content
+        stat = os.stat(path)
+        self._write("paper.pdf", b"%PDF-2")
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+        self.assertIsNone(cache.get(path, "pdftotext"))
+
+    def test_eviction(self):
+        cache = TextCache(self.db_path, max_size=10)
+        paths = [self._write("paper%d.pdf" % (i,), b"%%PDF-%d" % (i,))
+                 for i in range(3)]
+        cache.set(paths[0], "pdftotext", "aaaa")
+        time.sleep(0.01)
+        cache.set(paths[1], "pdftotext", "bbbb")
+        time.sleep(0.01)
+        # Use the first one, so that the second one is evicted
+        self.assertEqual(cache.get(paths[0], "pdftotext"), "aaaa")
+        time.sleep(0.01)
+        cache.set(paths[2], "pdftotext", "cccc")
+        self.assertEqual(cache.get(paths[0], "pdftotext"), "aaaa")
+        self.assertIsNone(cache.get(paths[1], "pdftotext"))
+        self.assertEqual(cache.get(paths[2], "pdftotext"), "cccc")
@@ -0,0 +1,181 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+from libbmc import doi
+from libbmc.cache import MemoryCache, PersistentCache
+
+
+def make_response(status_code, headers=None, text=""):
+    """
+    Build a fake response from dx.doi.org.
+    """
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response._content = text.encode("utf-8")
+    response.url = "http://dx.doi.org/"
+    return response
+
+
+class TestBibTeX(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.cache = PersistentCache(os.path.join(tmpdir.name,
+                                                  "cache.sqlite"))
+
+    def test_get_bibtex_many(self):
+        responses = {
+            "http://dx.doi.org/10.1/found": make_response(
+                200, {"content-type": "application/x-bibtex"}, "@article{}"),
+            "http://dx.doi.org/10.1/missing": make_response(404),
+            "http://dx.doi.org/10.1/limited": make_response(429),
+            "http://dx.doi.org/10.1/forbidden": make_response(403),
+            "http://dx.doi.org/10.1/broken": make_response(503)
+        }
+        dois = ["10.1/found", "10.1/missing", "10.1/limited",
+                "10.1/forbidden", "10.1/broken"]
+        with mock.patch("libbmc.network.get",
+                        side_effect=lambda url, **kwargs: responses[url]), \
+                mock.patch.object(self.cache, "set_many",
+                                  wraps=self.cache.set_many) as set_many:
+            self.assertEqual(doi.get_bibtex_many(dois, max_rate=1000,
+                                                 bibtex_cache=self.cache),
+                             {"10.1/found": "@article{}",
+                              "10.1/missing": None,
+                              "10.1/limited": None,
+                              "10.1/forbidden": None,
+                              "10.1/broken": None})
+        # Written in a single transaction
+        self.assertEqual(set_many.call_count, 1)
+        # Only definitive answers are cached
+        self.assertEqual(
+            self.cache.get_many("doi.bibtex:%s" % (i,) for i in dois),
+            {"doi.bibtex:10.1/found": "@article{}",
+             "doi.bibtex:10.1/missing": None})
+
+
+class TestDissemin(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(doi, "DISSEMIN_CACHE",
+                                    MemoryCache(max_size=16, ttl=3600))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.responses = {
+            doi.DISSEMIN_API + "10.1/found": make_response(
+                200, text='{"status": "ok", "paper": {"pdf_url": "url"}}'),
+            doi.DISSEMIN_API + "10.1/missing": make_response(
+                404, text='{"status": "error"}'),
+            doi.DISSEMIN_API + "10.1/broken": make_response(200, text="<")
+        }
+
+    def test_get_dissemin_record(self):
+        with mock.patch("libbmc.network.get",
+                        side_effect=lambda url: self.responses[url]) as get:
+            self.assertEqual(doi.get_dissemin_record("10.1/found"),
+                             {"pdf_url": "url"})
+            # Served from the cache
+            self.assertEqual(doi.get_dissemin_record("10.1/found"),
+                             {"pdf_url": "url"})
+            self.assertEqual(get.call_count, 1)
+            # Errors are not cached
+            self.assertIsNone(doi.get_dissemin_record("10.1/missing"))
+            self.assertIsNone(doi.get_dissemin_record("10.1/missing"))
+            self.assertEqual(get.call_count, 3)
+
+    def test_get_dissemin_records(self):
+        with mock.patch("libbmc.network.get",
+                        side_effect=lambda url: self.responses[url]):
+            self.assertEqual(
+                doi.get_dissemin_records(["10.1/found", "10.1/missing",
+                                          "10.1/broken"]),
+                {"10.1/found": {"pdf_url": "url"},
+                 "10.1/missing": None,
+                 "10.1/broken": None})
+
+
+class TestLinkedVersions(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.cache = PersistentCache(os.path.join(tmpdir.name,
+                                                  "cache.sqlite"))
+        self.responses = {
+            "http://dx.doi.org/10.1/found": make_response(
+                303, {"location": "http://example.com/found"}),
+            "http://dx.doi.org/10.1/missing": make_response(404),
+            "http://dx.doi.org/10.1/limited": make_response(429),
+            "http://dx.doi.org/10.1/publisher": make_response(
+                302, {"location": "http://example.com/publisher"}),
+            "http://example.com/publisher": make_response(
+                302, {"location": "/article"}),
+            # Publishers often reject HEAD requests
+            "http://example.com/article": make_response(405)
+        }
+        patcher = mock.patch(
+            "libbmc.network.head",
+            side_effect=lambda url, **kwargs: self.responses[url])
+        self.head = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_iter_linked_versions(self):
+        self.assertEqual(
+            dict(doi.iter_linked_versions(["10.1/found", "10.1/missing",
+                                           "10.1/limited"])),
+            {"10.1/found": "http://example.com/found",
+             "10.1/missing": None,
+             "10.1/limited": None})
+
+    def test_iter_linked_versions_later_hops(self):
+        dois = ["10.1/publisher", "10.1/limited"]
+        for max_redirects, url in [(1, "http://example.com/publisher"),
+                                   (3, "http://example.com/article")]:
+            self.assertEqual(
+                dict(doi.iter_linked_versions(dois,
+                                              max_redirects=max_redirects,
+                                              linked_cache=self.cache)),
+                {"10.1/publisher": url, "10.1/limited": None})
+            self.assertEqual(
+                self.cache.get("doi.linked_version:%d:10.1/publisher" %
+                               (max_redirects,)),
+                url)
+
+    def test_iter_linked_versions_cache(self):
+        dois = ["10.1/found", "10.1/missing", "10.1/limited"] * 2
+        with mock.patch.object(doi, "CACHE_BATCH_SIZE", 2):
+            for _ in range(2):
+                self.assertEqual(
+                    dict(doi.iter_linked_versions(dois,
+                                                  linked_cache=self.cache)),
+                    {"10.1/found": "http://example.com/found",
+                     "10.1/missing": None,
+                     "10.1/limited": None})
+        # Only the rate-limited DOI is fetched again
+        self.assertEqual(
+            sorted(call[0][0] for call in self.head.call_args_list),
+            ["http://dx.doi.org/10.1/found",
+             "http://dx.doi.org/10.1/limited",
+             "http://dx.doi.org/10.1/limited",
+             "http://dx.doi.org/10.1/limited",
+             "http://dx.doi.org/10.1/limited",
+             "http://dx.doi.org/10.1/missing"])
+        self.assertEqual(
+            self.cache.get_many(["doi.linked_version:1:10.1/found",
+                                 "doi.linked_version:1:10.1/missing",
+                                 "doi.linked_version:1:10.1/limited"]),
+            {"doi.linked_version:1:10.1/found": "http://example.com/found",
+             "doi.linked_version:1:10.1/missing": None})
+
+    def test_iter_linked_versions_single_transaction(self):
+        with mock.patch.object(self.cache, "set_many",
+                               wraps=self.cache.set_many) as set_many, \
+                mock.patch.object(self.cache, "get_many",
+                                  wraps=self.cache.get_many) as get_many:
+            list(doi.iter_linked_versions(["10.1/found", "10.1/missing"],
+                                          linked_cache=self.cache))
+        self.assertEqual(get_many.call_count, 1)
+        self.assertEqual(set_many.call_count, 1)
@@ -1,8 +1,101 @@
+import http.server
+import io
+import os
+import socket
+import tempfile
+import threading
+import time
 import unittest
+from libbmc import fetcher
+from libbmc import network
+from libbmc.cache import DownloadCache
 from libbmc.fetcher import *
 
 
+# Fake PDF document served by the local test server
+PDF_CONTENT = b"%PDF-1.4\n" + b"0" * (3 * 1024 * 1024)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    # Number of full documents sent
+    documents_sent = 0
+
+    def _send_document(self, with_body):
+        start, end = 0, len(PDF_CONTENT) - 1
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        if "Range" in self.headers:
+            first, last = self.headers["Range"][len("bytes="):].split("-")
+            start = int(first)
+            if start >= len(PDF_CONTENT):
+                self.send_response(416)
+                self.send_header("Content-Range",
+                                 "bytes */%d" % (len(PDF_CONTENT),))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if last:
+                end = int(last)
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d" %
+                             (start, end, len(PDF_CONTENT)))
+        else:
+            self.send_response(200)
+        if self.path == "/unlabelled.pdf":
+            self.send_header("Content-Type", "application/octet-stream")
+        else:
+            self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(end + 1 - start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        if not with_body:
+            return
+        if "Range" not in self.headers:
+            _Handler.documents_sent += 1
+        if self.path == "/flaky.pdf":
+            # Drop the connection after 512 KiB
+            end = min(end, start + 512 * 1024)
+            self.close_connection = True
+        self.wfile.write(PDF_CONTENT[start:end + 1])
+
+    def do_HEAD(self):
+        self._send_document(False)
+
+    def do_GET(self):
+        if self.path in ["/paper.pdf", "/mirror.pdf", "/flaky.pdf",
+                         "/unlabelled.pdf"]:
+            self._send_document(True)
+        else:
+            body = b"<html></html>"
+            self.send_response(200)
+            if self.path == "/unlabelled.html":
+                self.send_header("Content-Type", "application/octet-stream")
+            else:
+                self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
 class TestFetcher(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                                     _Handler)
+        cls.base_url = "http://127.0.0.1:%d" % (cls.server.server_port,)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
     def test_download(self):
         dl, contenttype = download('http://arxiv.org/pdf/1312.4006.pdf')
         self.assertIn(contenttype, ['pdf', 'djvu'])
@@ -13,3 +106,210 @@ class TestFetcher(unittest.TestCase):
 
     def test_download_invalid_url(self):
         self.assertEqual(download('a'), (None, None))
+
+    def test_download_local(self):
+        self.assertEqual(download(self.base_url + "/paper.pdf"),
+                         (PDF_CONTENT, "pdf"))
+
+    def test_download_to_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "paper.pdf")
+            self.assertEqual(
+                download_to_file(self.base_url + "/paper.pdf", path),
+                (len(PDF_CONTENT), "pdf"))
+            with open(path, "rb") as fh:
+                self.assertEqual(fh.read(), PDF_CONTENT)
+
+    def test_download_to_file_invalid_type(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "paper.pdf")
+            self.assertEqual(
+                download_to_file(self.base_url + "/index.html", path),
+                (None, None))
+            self.assertFalse(os.path.exists(path))
+        with io.BytesIO() as file_object:
+            self.assertEqual(
+                download_to_file(self.base_url + "/index.html", file_object),
+                (None, None))
+            self.assertEqual(file_object.getvalue(), b"")
+
+    def test_download_many(self):
+        urls = [self.base_url + "/paper.pdf", self.base_url + "/index.html"]
+        results = dict(download_many(urls, max_workers=2, per_host_limit=1))
+        self.assertEqual(results, {urls[0]: (PDF_CONTENT, "pdf"),
+                                   urls[1]: (None, None)})
+
+    def test_download_many_failure(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            missing = os.path.join(tmpdir, "missing", "paper.pdf")
+            path = os.path.join(tmpdir, "paper.pdf")
+            urls = [(self.base_url + "/paper.pdf", missing),
+                    (self.base_url + "/mirror.pdf", path),
+                    self.base_url + "/paper.pdf"]
+            results = dict(download_many(urls, max_workers=2))
+            self.assertEqual(results, {urls[0]: (None, None),
+                                       urls[1]: (len(PDF_CONTENT), "pdf"),
+                                       urls[2]: (PDF_CONTENT, "pdf")})
+
+    def test_download_hedged(self):
+        # A proxy accepting connections but never answering
+        dead_proxy = socket.socket()
+        dead_proxy.bind(("127.0.0.1", 0))
+        dead_proxy.listen(1)
+        with dead_proxy:
+            proxies = ["127.0.0.1:%d" % (dead_proxy.getsockname()[1],), ""]
+            start = time.time()
+            self.assertEqual(download(self.base_url + "/paper.pdf", proxies,
+                                      hedge_delay=0.2),
+                             (PDF_CONTENT, "pdf"))
+            self.assertLess(time.time() - start, 5)
+
+    def test_download_hedged_no_proxy(self):
+        self.assertEqual(download(self.base_url + "/paper.pdf", [],
+                                  hedge_delay=0.1),
+                         (None, None))
+
+    def test_download_write_error(self):
+        class FullDisk(io.BytesIO):
+            def write(self, buf):
+                raise OSError(28, "No space left on device")
+
+        reset_proxies_health()
+        for hedge_delay in [None, 0.1]:
+            with FullDisk() as file_object:
+                with self.assertRaises(OSError):
+                    download_to_file(self.base_url + "/paper.pdf",
+                                     file_object, hedge_delay=hedge_delay)
+        # Not the fault of the proxy
+        self.assertEqual(sort_proxies(["", "localhost:3128"]),
+                         ["", "localhost:3128"])
+        self.assertEqual(fetcher._PROXY_FAILURES, {})
+
+    def test_sort_proxies(self):
+        # A proxy refusing connections
+        with socket.socket() as refused_proxy:
+            refused_proxy.bind(("127.0.0.1", 0))
+            proxy = "127.0.0.1:%d" % (refused_proxy.getsockname()[1],)
+        reset_proxies_health()
+        # Do not wait for retries of the refused connections
+        retries = network.SETTINGS["retries"]
+        network.configure(retries=0)
+        self.addCleanup(network.configure, retries=retries)
+        self.assertEqual(sort_proxies([proxy, ""]), [proxy, ""])
+        self.assertEqual(download(self.base_url + "/paper.pdf", [proxy]),
+                         (None, None))
+        self.assertEqual(sort_proxies([proxy, ""]), ["", proxy])
+        for _ in range(MAX_PROXY_FAILURES - 1):
+            download(self.base_url + "/paper.pdf", [proxy])
+        self.assertEqual(sort_proxies([proxy, ""]), [""])
+        self.assertEqual(sort_proxies([proxy]), [proxy])
+        reset_proxies_health()
+
+    def test_download_resumable(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "paper.pdf")
+            # Start from an interrupted download
+            with open(path + ".part", "wb") as fh:
+                fh.write(PDF_CONTENT[:1000])
+            self.assertEqual(
+                download_resumable(self.base_url + "/flaky.pdf", path,
+                                   max_retries=10),
+                (len(PDF_CONTENT), "pdf"))
+            self.assertFalse(os.path.exists(path + ".part"))
+            with open(path, "rb") as fh:
+                self.assertEqual(fh.read(), PDF_CONTENT)
+
+    def test_download_resumable_complete(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "paper.pdf")
+            # Interrupted between the last write and the renaming
+            with open(path + ".part", "wb") as fh:
+                fh.write(PDF_CONTENT)
+            documents_sent = _Handler.documents_sent
+            self.assertEqual(
+                download_resumable(self.base_url + "/paper.pdf", path),
+                (len(PDF_CONTENT), "pdf"))
+            self.assertEqual(_Handler.documents_sent, documents_sent)
+            self.assertEqual(os.listdir(tmpdir), ["paper.pdf"])
+            with open(path, "rb") as fh:
+                self.assertEqual(fh.read(), PDF_CONTENT)
+
+    def test_download_resumable_segments(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "paper.pdf")
+            self.assertEqual(
+                download_resumable(self.base_url + "/flaky.pdf", path,
+                                   max_retries=10, segments=4),
+                (len(PDF_CONTENT), "pdf"))
+            self.assertEqual(os.listdir(tmpdir), ["paper.pdf"])
+            with open(path, "rb") as fh:
+                self.assertEqual(fh.read(), PDF_CONTENT)
+
+    def test_download_unlabelled(self):
+        self.assertEqual(download(self.base_url + "/unlabelled.pdf"),
+                         (PDF_CONTENT, "pdf"))
+        self.assertEqual(download(self.base_url + "/unlabelled.html"),
+                         (None, None))
+
+    def test_download_progress(self):
+        events = []
+        self.assertEqual(download(self.base_url + "/paper.pdf",
+                                  progress=events.append),
+                         (PDF_CONTENT, "pdf"))
+        self.assertEqual(events[0]["status"], "started")
+        self.assertEqual(events[-1]["status"], "finished")
+        self.assertEqual(events[-1]["downloaded"], len(PDF_CONTENT))
+        self.assertEqual(events[-1]["size"], len(PDF_CONTENT))
+        self.assertGreaterEqual(events[-1]["elapsed"], events[-1]["ttfb"])
+        self.assertEqual(events[-1]["received"], len(PDF_CONTENT))
+
+    def test_download_progress_resumed(self):
+        offset = len(PDF_CONTENT) - 1024
+        events = []
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "paper.pdf")
+            with open(path + ".part", "wb") as fh:
+                fh.write(PDF_CONTENT[:offset])
+            self.assertEqual(
+                download_resumable(self.base_url + "/paper.pdf", path,
+                                   progress=events.append),
+                (len(PDF_CONTENT), "pdf"))
+        self.assertEqual(events[0]["status"], "started")
+        self.assertEqual(events[0]["downloaded"], offset)
+        self.assertEqual(events[0]["received"], 0)
+        self.assertEqual(events[-1]["downloaded"], len(PDF_CONTENT))
+        # Speed only accounts for the bytes received by this request
+        self.assertEqual(events[-1]["received"], 1024)
+        transfer_time = events[-1]["elapsed"] - events[-1]["ttfb"]
+        self.assertAlmostEqual(events[-1]["speed"] * transfer_time, 1024)
+
+    def test_download_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = DownloadCache(tmpdir)
+            url = self.base_url + "/paper.pdf"
+            documents_sent = _Handler.documents_sent
+            for _ in range(2):
+                self.assertEqual(download(url, cache=cache),
+                                 (PDF_CONTENT, "pdf"))
+            # Second download was revalidated
+            self.assertEqual(_Handler.documents_sent, documents_sent + 1)
+            # Same content at another URL is stored only once
+            mirror_url = self.base_url + "/mirror.pdf"
+            self.assertEqual(download(mirror_url, cache=cache),
+                             (PDF_CONTENT, "pdf"))
+            self.assertEqual(
+                len(os.listdir(os.path.join(tmpdir, "objects"))), 1)
+            self.assertEqual(cache.lookup(mirror_url)["etag"], '"v1"')
+
+    def test_download_cache_eviction(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = DownloadCache(tmpdir, max_size=len(PDF_CONTENT))
+            old_path = os.path.join(tmpdir, "old.pdf")
+            with open(old_path, "wb") as fh:
+                fh.write(b"%PDF-old")
+            cache.store("http://example.com/old.pdf", old_path, "pdf")
+            url = self.base_url + "/paper.pdf"
+            self.assertEqual(download(url, cache=cache),
+                             (PDF_CONTENT, "pdf"))
+            self.assertIsNone(cache.lookup("http://example.com/old.pdf"))
+            self.assertEqual(cache.lookup(url)["size"], len(PDF_CONTENT))
@@ -0,0 +1,209 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+from libbmc.papers import identifiers
+from libbmc.tests.helpers import make_pdf
+
+
+# Texts with identifiers starting inside longer identifier-like candidates
+SCANNED_TEXTS = [
+    "Tel: 0123-456-7891401.2910",
+    "pages 1234567891401.2910",
+    "2016-01-1210.1103/PhysRevB.93.064508",
+    "see 2016-01-12 10.1103/PhysRevB.93.064508 and arXiv:1401.2910, "
+    "ISBN 978-3-16-148410-0",
+    "no identifier at all"
+]
+
+
+class TestScanIdentifiers(unittest.TestCase):
+    def test_same_as_extractors(self):
+        for text in SCANNED_TEXTS:
+            expected = set()
+            for identifier_type in identifiers.__valid_identifiers__:
+                module = identifiers._get_module(identifier_type)
+                expected.update((identifier_type, found)
+                                for found in module.extract_from_text(text))
+            found = identifiers.scan_identifiers(text)
+            self.assertEqual(set((identifier_type, identifier_id)
+                                 for identifier_type, identifier_id, _
+                                 in found),
+                             expected, text)
+            self.assertEqual(found, sorted(found, key=lambda x: x[2]))
+
+    def test_first(self):
+        self.assertEqual(
+            identifiers.scan_identifiers("Tel: 0123-456-7891401.2910",
+                                         first=True),
+            [("repositories.arxiv", "1401.2910", 17)])
+        self.assertEqual(
+            identifiers.scan_identifiers(SCANNED_TEXTS[3], first=True),
+            [("doi", "10.1103/PhysRevB.93.064508", 15)])
+
+
+class TestPyPDF2Backend(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, "paper.pdf")
+        with open(self.path, "wb") as fh:
+            fh.write(make_pdf(["Introduction", "Results",
+                               "doi:10.1209/0295-5075/111/40005"]))
+        self.broken_path = os.path.join(tmpdir.name, "broken.pdf")
+        with open(self.broken_path, "wb") as fh:
+            fh.write(b"%PDF-1.4\nnot a PDF file")
+        patcher = mock.patch.object(identifiers, "PDF_BACKEND", "pypdf2")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_automatic_backend(self):
+        with mock.patch.object(identifiers, "PDF_BACKEND", None), \
+                mock.patch.object(identifiers, "_has_pdftotext",
+                                  return_value=False):
+            self.assertEqual(identifiers._get_pdf_backend(), "pypdf2")
+
+    def test_page_range(self):
+        self.assertEqual(list(identifiers._iter_lines(self.path, 1, 2)),
+                         ["Introduction", "", "Results", ""])
+        self.assertEqual(list(identifiers._iter_lines(self.path, 4, 8)), [])
+
+    def test_find_identifiers(self):
+        for pages in [None, 1]:
+            self.assertEqual(identifiers.find_identifiers(self.path,
+                                                          pages=pages),
+                             ("doi", "10.1209/0295-5075/111/40005"))
+
+    def test_find_identifiers_broken(self):
+        self.assertEqual(identifiers.find_identifiers(self.broken_path),
+                         (None, None))
+
+
+
+@unittest.skipIf(shutil.which("pdftotext") is None, "pdftotext is missing")
+class TestPdftotextBackend(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, "paper.pdf")
+        with open(self.path, "wb") as fh:
+            fh.write(make_pdf(["Introduction", "Results",
+                               "doi:10.1209/0295-5075/111/40005",
+                               "arXiv:1401.2910", "Appendix"]))
+        patcher = mock.patch.object(identifiers, "PDF_BACKEND", "pdftotext")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        popen = mock.patch.object(identifiers.subprocess, "Popen",
+                                  wraps=subprocess.Popen)
+        self.popen = popen.start()
+        self.addCleanup(popen.stop)
+
+    def _page_ranges(self):
+        ranges = []
+        for call in self.popen.call_args_list:
+            command = call[0][0]
+            ranges.append((int(command[command.index("-f") + 1]),
+                           int(command[command.index("-l") + 1])))
+        return ranges
+
+    def test_page_range(self):
+        lines = [line for line in identifiers._iter_lines(self.path, 2, 3)
+                 if line]
+        self.assertEqual(lines, ["Results",
+                                 "doi:10.1209/0295-5075/111/40005"])
+        self.assertEqual(self._page_ranges(), [(2, 3)])
+
+    def test_find_identifiers_pages(self):
+        self.assertEqual(identifiers.find_identifiers(self.path, pages=1),
+                         ("doi", "10.1209/0295-5075/111/40005"))
+        # Stopped as soon as the DOI was found, in the second range
+        self.assertEqual(self._page_ranges(), [(1, 1), (2, 3)])
+
+    def test_find_identifiers_past_end(self):
+        with open(self.path, "wb") as fh:
+            fh.write(make_pdf(["Introduction", "Results"]))
+        self.assertEqual(identifiers.find_identifiers(self.path, pages=1),
+                         (None, None))
+        self.assertEqual(self._page_ranges(), [(1, 1), (2, 3), (4, 7)])
+
+
+class TestFindIdentifiersInTree(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.root = os.path.join(tmpdir.name, "papers")
+        self.checkpoint = os.path.join(tmpdir.name, "checkpoint.jsonl")
+        self.expected = {}
+        for i in range(4):
+            directory = os.path.join(self.root, "dir%d" % (i % 2,))
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, "paper%d.pdf" % (i,))
+            identifier = "10.1209/0295-5075/111/4000%d" % (i,)
+            with open(path, "wb") as fh:
+                fh.write(make_pdf(["doi:%s" % (identifier,)]))
+            self.expected[path] = ("doi", identifier)
+        patcher = mock.patch.object(identifiers, "PDF_BACKEND", "pypdf2")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _run(self, **kwargs):
+        return identifiers.find_identifiers_in_tree(
+            self.root, workers=2, checkpoint=self.checkpoint, **kwargs)
+
+    def test_resume(self):
+        # Interrupt a first run after two files
+        results = self._run()
+        first = [next(results) for _ in range(2)]
+        results.close()
+        # Simulate a line truncated by the interruption
+        with open(self.checkpoint, "a") as fh:
+            fh.write('{"path": "')
+        second = list(self._run())
+        found = {path: (identifier_type, identifier_id)
+                 for path, identifier_type, identifier_id in first + second}
+        self.assertEqual(len(first + second), 4)
+        self.assertEqual(found, self.expected)
+        # Nothing left to do
+        self.assertEqual(list(self._run()), [])
+        with open(self.checkpoint, "r") as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual(len(lines), 5)
+
+
+class TestGetBibTeXMany(unittest.TestCase):
+    def setUp(self):
+        # Batched module and module with a single identifier helper only
+        self.doi = mock.Mock(spec=["get_bibtex_many"])
+        self.doi.get_bibtex_many.side_effect = lambda ids: {
+            i: "@doi{%s}" % (i,) for i in ids}
+        self.isbn = mock.Mock(spec=["get_bibtex"])
+        self.isbn.get_bibtex.side_effect = lambda i: "@isbn{%s}" % (i,)
+        modules = {"doi": self.doi, "isbn": self.isbn}
+        patcher = mock.patch.object(identifiers, "_get_module",
+                                    side_effect=modules.get)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_bibtex_many(self):
+        self.assertEqual(
+            identifiers.get_bibtex_many([
+                ("isbn", "9783161484100"),
+                ("doi", "10.1/b"),
+                ("unknown", "x"),
+                ("doi", "10.1/a"),
+                ("arxiv", "1401.2910"),
+                ("doi", "10.1/b"),
+            ]),
+            ["@isbn{9783161484100}", "@doi{10.1/b}", None, "@doi{10.1/a}",
+             None, "@doi{10.1/b}"])
+        # One batched call per type, without duplicates
+        self.doi.get_bibtex_many.assert_called_once_with(mock.ANY)
+        self.assertEqual(
+            sorted(self.doi.get_bibtex_many.call_args[0][0]),
+            ["10.1/a", "10.1/b"])
+        self.isbn.get_bibtex.assert_called_once_with("9783161484100")
+
+    def test_get_bibtex_many_empty(self):
+        self.assertEqual(identifiers.get_bibtex_many([]), [])
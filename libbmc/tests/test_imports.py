@@ -0,0 +1,31 @@
+import subprocess
+import sys
+import unittest
+
+
+# Third-party modules only loaded on first use
+HEAVY_MODULES = ["requests", "isbnlib", "arxiv2bib", "PyPDF2"]
+
+
+class TestImports(unittest.TestCase):
+    def _loaded_modules(self, code):
+        output = subprocess.check_output(
+            [sys.executable, "-c",
+             code + "\nimport sys\nprint(' '.join(sys.modules))"])
+        return set(output.decode("utf-8").split())
+
+    def test_lazy_imports(self):
+        loaded = self._loaded_modules(
+            "import libbmc.papers.identifiers, libbmc.doi, libbmc.isbn, "
+            "libbmc.repositories.arxiv")
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, loaded)
+
+    def test_scan_without_network(self):
+        loaded = self._loaded_modules(
+            "from libbmc.papers import identifiers\n"
+            "assert identifiers.scan_identifiers("
+            "'doi:10.1103/PhysRevB.1.1', first=True) == "
+            "[('doi', '10.1103/PhysRevB.1.1', 4)]")
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, loaded)
@@ -1,7 +1,16 @@
 """
 This file contains various utility functions.
 """
+import collections
+import concurrent.futures
+import importlib
+import json
+import os
 import re
+import sys
+import threading
+import time
+import types
 import unicodedata
 
 from itertools import islice, chain
@@ -13,6 +22,129 @@ _SLUGIFY_STRIP_RE = re.compile(r'[^\w\s-]')
 _SLUGIFY_HYPHENATE_RE = re.compile(r'[\s]+')
 
 
+class _LazyModule(types.ModuleType):
+    """
+    A placeholder for a module, importing it on first access to one of its \
+    attributes.
+    """
+    def __getattr__(self, attribute):
+        # Only called for attributes not found on the placeholder itself.
+        # ``import_module`` is thread-safe, and returns the already imported
+        # module on subsequent calls.
+        return getattr(importlib.import_module(self.__name__), attribute)
+
+
+def lazy_import(name):
+    """
+    Import a module lazily, that is on first access to one of its attributes.
+
+    .. note::
+
+        This is used for heavy dependencies, so that importing libbmc \
+                modules stays cheap for short-lived processes which do not \
+                need them.
+
+    :param name: The full name of the module.
+    :returns: The module if it is already imported, or a placeholder for it.
+
+    >>> json = lazy_import("json")
+    >>> json.dumps([1])
+    '[1]'
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return _LazyModule(name)
+
+
+class RateLimiter(object):
+    """
+    Limit the rate of the requests to a host, across threads.
+
+    :param max_rate: Maximum number of requests per second.
+    """
+    def __init__(self, max_rate):
+        self.interval = 1.0 / max_rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Wait until a new request can be sent.
+        """
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Checkpoint(object):
+    """
+    An append-only JSON lines file recording the items processed by a long \
+    run, so that an interrupted run can be resumed where it stopped.
+
+    .. note::
+
+        Lines truncated by an interrupted run are ignored when reading the \
+                checkpoint, and terminated before appending new records.
+
+    :param path: The path to the checkpoint file. Created if needed.
+    :param key: The key of the records identifying the processed items.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     path = os.path.join(tmpdir, "checkpoint.jsonl")
+    ...     with Checkpoint(path, "id") as checkpoint:
+    ...         checkpoint.append({"id": 1, "value": "a"})
+    ...     with open(path, "a") as fh:
+    ...         _ = fh.write('{"id": 2, "val')
+    ...     with Checkpoint(path, "id") as checkpoint:
+    ...         checkpoint.append({"id": 3, "value": "c"})
+    ...     sorted(Checkpoint(path, "id").processed)
+    [1, 3]
+    """
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.processed = set()
+        self._fh = None
+        try:
+            with open(path, 'r') as fh:
+                for line in fh:
+                    try:
+                        self.processed.add(json.loads(line)[key])
+                    except (ValueError, KeyError):
+                        # Line truncated by an interrupted run
+                        continue
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        self._fh = open(self.path, 'ab+')
+        # Terminate a line truncated by an interrupted run
+        if self._fh.seek(0, os.SEEK_END) > 0:
+            self._fh.seek(-1, os.SEEK_END)
+            if self._fh.read(1) != b"\n":
+                self._fh.write(b"\n")
+        return self
+
+    def __exit__(self, *args):
+        self._fh.close()
+        self._fh = None
+
+    def append(self, record):
+        """
+        Append a record to the checkpoint, and flush it to disk.
+
+        :param record: A JSON-serializable dict, with a ``key`` entry.
+        """
+        self._fh.write(json.dumps(record).encode("utf-8") + b"\n")
+        self._fh.flush()
+        self.processed.add(record[self.key])
+
+
 def replace_all(text, replace_dict):
     """
     Replace multiple strings in a text.
@@ -84,6 +216,48 @@ def remove_duplicates(some_list):
     return list(set(some_list))
 
 
+def trie_regex(words):
+    """
+    Build a regular expression matching any of the given words, factorizing \
+            their common prefixes as a trie.
+
+    .. note::
+
+        This is much faster than a plain alternation of the words, which \
+                the regular expression engine tries one after the other at \
+                each position.
+
+    :param words: An iterable of words.
+    :returns: A regular expression pattern (without capturing groups), as \
+            a string.
+
+    >>> trie_regex(["foo", "foobar", "fox"])
+    'fo(?:o(?:bar)?|x)'
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        # Mark the end of a word
+        node[""] = {}
+
+    def to_regex(node):
+        """
+        Build the regular expression matching a node of the trie.
+        """
+        alternatives = [re.escape(char) + to_regex(child)
+                        for char, child in sorted(node.items()) if char]
+        if not alternatives:
+            return ""
+        optional = "" in node
+        if len(alternatives) == 1 and not optional:
+            return alternatives[0]
+        return "(?:%s)%s" % ("|".join(alternatives), "?" if optional else "")
+
+    return to_regex(trie)
+
+
 def batch(iterable, size):
     """
     Get items from a sequence a batch at a time.
@@ -114,6 +288,109 @@ def batch(iterable, size):
             return
 
 
+def concurrent_map(function, iterable, max_workers=4, key=None,
+                   per_key_limit=None,
+                   executor_class=concurrent.futures.ThreadPoolExecutor,
+                   return_exceptions=False):
+    """
+    Apply a function on every item of an iterable, using a pool of workers, \
+            and yield the results as soon as they are available.
+
+    .. note::
+
+        Items are pulled lazily from the iterable, so that only a bounded \
+                number of them are pending at any time.
+
+    :param function: The function to apply.
+    :param iterable: An iterable of items to feed the function with.
+    :param max_workers: Maximum number of concurrent calls to ``function``.
+    :param key: An optional function mapping an item to a key (e.g. the \
+            host of an URL), to limit the concurrency per key.
+    :param per_key_limit: Maximum number of concurrent calls for items \
+            sharing the same key. Only used if ``key`` is provided.
+    :param executor_class: The class of the pool of workers. Defaults to \
+            a pool of threads, use ``concurrent.futures.ProcessPoolExecutor`` \
+            for CPU-bound functions (``function`` and the items should then \
+            be picklable).
+    :param return_exceptions: If ``True``, exceptions raised by \
+            ``function`` are yielded as the result of the matching item, \
+            instead of being raised again, so that one failing item does \
+            not stop the others.
+    :returns: A generator of ``(item, result)`` tuples, in completion order. \
+            Exceptions raised by ``function`` are raised again on the \
+            matching item, unless ``return_exceptions`` is ``True``.
+
+    >>> sorted(concurrent_map(lambda x: x * 2, [1, 2, 3], max_workers=2))
+    [(1, 2), (2, 4), (3, 6)]
+
+    >>> sorted(concurrent_map(lambda x: -x, [1, 2, 3, 4], key=lambda x: x % 2,
+    ...                       per_key_limit=1))
+    [(1, -1), (2, -2), (3, -3), (4, -4)]
+
+    >>> sorted(concurrent_map(lambda x: 1 // x, [0, 1],
+    ...                       return_exceptions=True), key=lambda x: x[0])
+    [(0, ZeroDivisionError('integer division or modulo by zero')), (1, 1)]
+    """
+    if key is None or per_key_limit is None:
+        key = lambda item: None
+        per_key_limit = max_workers
+
+    items = iter(iterable)
+    exhausted = False
+    # Items pulled from the iterable but waiting for their key to be free
+    waiting = collections.deque()
+    max_waiting = 4 * max_workers
+    running = {}
+    running_per_key = collections.Counter()
+
+    with executor_class(max_workers) as executor:
+        def submit(item, item_key):
+            """
+            Submit an item to the pool.
+            """
+            future = executor.submit(function, item)
+            running[future] = (item, item_key)
+            running_per_key[item_key] += 1
+
+        while True:
+            # Schedule the waiting items first, to preserve ordering
+            still_waiting = collections.deque()
+            for item, item_key in waiting:
+                if (len(running) < max_workers and
+                        running_per_key[item_key] < per_key_limit):
+                    submit(item, item_key)
+                else:
+                    still_waiting.append((item, item_key))
+            waiting = still_waiting
+            # Then pull new items from the iterable
+            while (not exhausted and len(running) < max_workers and
+                   len(waiting) < max_waiting):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                item_key = key(item)
+                if running_per_key[item_key] < per_key_limit:
+                    submit(item, item_key)
+                else:
+                    waiting.append((item, item_key))
+
+            if not running:
+                # Nothing left to run
+                return
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                item, item_key = running.pop(future)
+                running_per_key[item_key] -= 1
+                exception = future.exception()
+                if exception is not None and return_exceptions:
+                    yield (item, exception)
+                else:
+                    yield (item, future.result())
+
+
 def remove_urls(text):
     """
     Remove URLs from a given text (only removes http, https and naked domains \